@@ -1,11 +1,21 @@
 from dotenv import load_dotenv
 import os
+# Searches upward for a .env; loads nothing when there is none (e.g. production)
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is not set")
 
+# Postgres connections the whole deployment may hold, shared by every uvicorn worker.
+# Keep it under the database's limit (60 on Supabase) with room for admin/other clients.
+# WEB_CONCURRENCY is also what uvicorn reads for its default worker count
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "50"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# "true"/"false" forces the prepared-statement cache on/off. Unset: on only for port 5432
+# (direct connection or session pooler), off for transaction pooling (Supabase's 6543)
+DB_PREPARED_STATEMENTS = os.getenv("DB_PREPARED_STATEMENTS")
+
 SMTP_SERVER = os.getenv("SMTP_SERVER")
 SMTP_PORT = os.getenv("SMTP_PORT")
 SMTP_EMAIL = os.getenv("SMTP_EMAIL")
@@ -1,6 +1,9 @@
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base
-from config import DATABASE_URL
+from sqlalchemy import text, make_url
+from config import DATABASE_URL, DB_MAX_CONNECTIONS, WEB_CONCURRENCY, DB_PREPARED_STATEMENTS
+from uuid import uuid4
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -9,16 +12,38 @@ logger = logging.getLogger(__name__)
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL is not set in environment variables")
 
+# Each worker gets an equal share of the connection budget: two thirds held open
+# (and warmed at startup), the rest as overflow for bursts
+_WORKER_CONNECTIONS = max(DB_MAX_CONNECTIONS // max(WEB_CONCURRENCY, 1), 2)
+_POOL_SIZE = max(_WORKER_CONNECTIONS * 2 // 3, 1)
+
+def _prepared_statements_enabled() -> bool:
+    """Whether statements can be cached per connection for this DATABASE_URL"""
+    if DB_PREPARED_STATEMENTS is not None:
+        return DB_PREPARED_STATEMENTS.strip().lower() in ("1", "true", "yes", "on")
+    # In transaction mode consecutive transactions may run on different backends, where a
+    # statement prepared earlier doesn't exist - only a dedicated backend can keep them
+    return (make_url(DATABASE_URL).port or 5432) == 5432
+
+if _prepared_statements_enabled():
+    # OPTIMIZATION: Hot statements are parsed/planned once per connection
+    _statement_cache_args = {"prepared_statement_cache_size": 256}
+else:
+    _statement_cache_args = {"prepared_statement_cache_size": 0, "statement_cache_size": 0}
+
 engine = create_async_engine(
     url=DATABASE_URL,
     echo=False,  # Turn off in production
     pool_pre_ping=True,
     pool_recycle=1800,
-    pool_size=5,  # Supabase free tier has connection limits
-    max_overflow=5,  # Keep total connections low for free tier
+    pool_size=_POOL_SIZE,
+    max_overflow=_WORKER_CONNECTIONS - _POOL_SIZE,  # pool_size + overflow = this worker's share
+    pool_timeout=30,  # Fail fast instead of queueing forever when the pool is exhausted
     connect_args={
         "ssl": "require",
-        "statement_cache_size": 0,
+        # Unique names so statements from different clients never collide on a pooled backend
+        "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4().hex}__",
+        **_statement_cache_args,
         "server_settings": {"jit": "off"}  # Helps with Supabase performance
     }
 )
@@ -41,7 +66,32 @@ async def get_db():
             await session.close()
 
 async def init_db():
-    """Initialize database tables (optional - use Alembic in production)"""
+    """Create missing tables and apply the idempotent upgrades in database.schemas"""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
-    logger.info("Database tables created")
\ No newline at end of file
+    logger.info("Database tables created/upgraded")
+
+async def warm_pool():
+    """Open pool_size connections up front so early requests skip the connect/TLS handshake"""
+    async def checkout():
+        conn = await engine.connect()
+        try:
+            await conn.execute(text("SELECT 1"))
+        except Exception:
+            await conn.close()
+            raise
+        return conn
+    
+    # Hold every connection until all are open, otherwise one could be reused and fewer get created
+    conns = await asyncio.gather(
+        *(checkout() for _ in range(engine.pool.size())),
+        return_exceptions=True
+    )
+    errors = [c for c in conns if isinstance(c, BaseException)]
+    for conn in conns:
+        if not isinstance(conn, BaseException):
+            await conn.close()  # Returns the connection to the pool, still open
+    
+    if errors:
+        raise errors[0]
+    logger.info(f"Warmed {len(conns)} database connections")
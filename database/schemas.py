@@ -1,9 +1,6 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey, Text, Boolean, text, Integer
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.sql import func
 import asyncio
-from database.initialization import Base, engine
-from sqlalchemy import Column, String, Integer, Float, Boolean, DateTime, ForeignKey, Text, Enum as SQLEnum, Table, Index
+from database.initialization import Base, init_db
+from sqlalchemy import Column, String, Integer, Float, Boolean, DateTime, ForeignKey, Text, Enum as SQLEnum, Table, Index, CheckConstraint, DDL, event
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func, text
 from sqlalchemy.orm import relationship
@@ -249,12 +246,14 @@ class MessageModel(Base):
     __tablename__ = "messages"
     
     id = Column(UUID(as_uuid=True), primary_key=True, server_default=text("gen_random_uuid()"))
-    project_id = Column(UUID(as_uuid=True), ForeignKey("projects.id", ondelete="CASCADE"), nullable=False, index=True)
+    project_id = Column(UUID(as_uuid=True), ForeignKey("projects.id", ondelete="CASCADE"), nullable=False)
     sender_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="SET NULL"))
+    # Name at send time, so history pages don't join user_profiles
+    sender_name = Column(String(255))
     
     content = Column(Text, nullable=False)
     
-    sent_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
+    sent_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     edited_at = Column(DateTime(timezone=True))
     is_deleted = Column(Boolean, default=False, nullable=False)
     
@@ -262,7 +261,10 @@ class MessageModel(Base):
     sender = relationship("UserModel", back_populates="sent_messages")
     
     __table_args__ = (
+        # Scanned backward for newest-first pages; its project_id prefix also serves stats counts
+        # and ON DELETE CASCADE from projects, so no single-column indexes are needed
         Index('idx_message_project_time', 'project_id', 'sent_at'),
+        Index('idx_message_sender', 'sender_id'),  # ON DELETE SET NULL from users
     )
 
 
@@ -276,6 +278,13 @@ class OTPVerificationModel(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     expires_at = Column(DateTime(timezone=True), nullable=False)
     is_used = Column(Boolean, default=False, nullable=False)
+    
+    __table_args__ = (
+        # At most one pending OTP per email; also serves the pending-OTP lookups
+        Index('idx_otp_pending_email', 'email', unique=True, postgresql_where=text('is_used = false')),
+        # Lets the per-minute expiry sweep find stale pending rows without scanning used ones
+        Index('idx_otp_pending_expiry', 'expires_at', postgresql_where=text('is_used = false')),
+    )
 
 
 class RefreshTokenModel(Base):
@@ -300,12 +309,153 @@ class DirectMessageModel(Base):
     sent_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     read_at = Column(DateTime(timezone=True))
     is_deleted = Column(Boolean, default=False, nullable=False)
+    
+    __table_args__ = (
+        # Both directions of a conversation are (sender, receiver) equality lookups, scanned backward by time
+        Index('idx_dm_pair_time', 'sender_id', 'receiver_id', 'sent_at'),
+        # Inbox side of the conversation list, and ON DELETE CASCADE from users
+        Index('idx_dm_receiver_time', 'receiver_id', 'sent_at'),
+        # Unread counts only ever look at unread rows
+        Index('idx_dm_unread', 'receiver_id', 'sender_id', postgresql_where=text('read_at IS NULL')),
+    )
 
+class DMConversationModel(Base):
+    """Latest message per DM pair, maintained by a trigger on direct_messages"""
+    __tablename__ = "dm_conversations"
+    
+    # Pair stored once as (least, greatest) so both directions hit the same row
+    user_a = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    user_b = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    last_message_id = Column(UUID(as_uuid=True), nullable=False)
+    last_sender_id = Column(UUID(as_uuid=True), nullable=False)
+    last_content = Column(Text, nullable=False)
+    last_is_deleted = Column(Boolean, nullable=False)
+    last_sent_at = Column(DateTime(timezone=True), nullable=False)
+    
+    __table_args__ = (
+        CheckConstraint('user_a <= user_b', name='ck_dm_conversation_pair_order'),
+        # Conversation list for either side of the pair, newest first
+        Index('idx_dm_conversation_a_time', 'user_a', 'last_sent_at'),
+        Index('idx_dm_conversation_b_time', 'user_b', 'last_sent_at'),
+    )
+
+# OPTIMIZATION: The conversation list reads one row per partner instead of ranking the
+# user's whole DM history. The trigger upserts the pair's row on every insert, and on
+# edits/soft deletes of the message that row points at. Batched inserts can land out of
+# order, so older messages never replace a newer one
+_DM_CONVERSATION_FUNCTION = DDL("""
+CREATE OR REPLACE FUNCTION dm_conversation_upsert() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO dm_conversations AS c (
+        user_a, user_b, last_message_id, last_sender_id, last_content, last_is_deleted, last_sent_at
+    )
+    VALUES (
+        LEAST(NEW.sender_id, NEW.receiver_id), GREATEST(NEW.sender_id, NEW.receiver_id),
+        NEW.id, NEW.sender_id, NEW.content, NEW.is_deleted, NEW.sent_at
+    )
+    ON CONFLICT (user_a, user_b) DO UPDATE SET
+        last_message_id = EXCLUDED.last_message_id,
+        last_sender_id = EXCLUDED.last_sender_id,
+        last_content = EXCLUDED.last_content,
+        last_is_deleted = EXCLUDED.last_is_deleted,
+        last_sent_at = EXCLUDED.last_sent_at
+    WHERE c.last_message_id = EXCLUDED.last_message_id
+        OR (TG_OP = 'INSERT' AND c.last_sent_at <= EXCLUDED.last_sent_at);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+""")
+_DM_CONVERSATION_TRIGGER = DDL("""
+CREATE OR REPLACE TRIGGER trg_dm_conversation_upsert
+AFTER INSERT OR UPDATE OF content, is_deleted ON direct_messages
+FOR EACH ROW EXECUTE FUNCTION dm_conversation_upsert()
+""")
+# Existing conversations are copied over when the table is first created
+_DM_CONVERSATION_BACKFILL = DDL("""
+INSERT INTO dm_conversations (
+    user_a, user_b, last_message_id, last_sender_id, last_content, last_is_deleted, last_sent_at
+)
+SELECT DISTINCT ON (LEAST(sender_id, receiver_id), GREATEST(sender_id, receiver_id))
+    LEAST(sender_id, receiver_id), GREATEST(sender_id, receiver_id),
+    id, sender_id, content, is_deleted, sent_at
+FROM direct_messages
+ORDER BY LEAST(sender_id, receiver_id), GREATEST(sender_id, receiver_id), sent_at DESC
+ON CONFLICT DO NOTHING
+""")
+
+# Created after direct_messages so the trigger and backfill have a table to work with
+DMConversationModel.__table__.add_is_dependent_on(DirectMessageModel.__table__)
+for _ddl in (_DM_CONVERSATION_FUNCTION, _DM_CONVERSATION_TRIGGER, _DM_CONVERSATION_BACKFILL):
+    event.listen(DMConversationModel.__table__, "after_create", _ddl.execute_if(dialect="postgresql"))
+
+# Upgrades for databases created before a column/index existed. create_all never alters an
+# existing table, but the metadata after_create hook runs on every init_db, so each of these
+# must be safe to repeat
+_SCHEMA_UPGRADES = (
+    # messages.sender_name: add the column, and backfill it from profiles the first time
+    DDL("""
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema()
+            AND table_name = 'messages' AND column_name = 'sender_name'
+    ) THEN
+        ALTER TABLE messages ADD COLUMN IF NOT EXISTS sender_name VARCHAR(255);
+        UPDATE messages m SET sender_name = p.name
+        FROM user_profiles p
+        WHERE p.user_id = m.sender_id AND m.sender_name IS NULL;
+    END IF;
+END
+$$
+"""),
+    # idx_otp_pending_email backs the ON CONFLICT upsert of pending OTPs. Older tables can
+    # hold several pending rows per email, so all but the newest are retired first
+    DDL("""
+DO $$
+BEGIN
+    IF to_regclass('idx_otp_pending_email') IS NULL THEN
+        UPDATE otp_verifications o SET is_used = true
+        WHERE o.is_used = false AND EXISTS (
+            SELECT 1 FROM otp_verifications n
+            WHERE n.email = o.email AND n.is_used = false
+                AND (n.created_at, n.id) > (o.created_at, o.id)
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_otp_pending_email
+            ON otp_verifications (email) WHERE is_used = false;
+    END IF;
+END
+$$
+"""),
+    DDL("""
+CREATE INDEX IF NOT EXISTS idx_otp_pending_expiry
+    ON otp_verifications (expires_at) WHERE is_used = false
+"""),
+    # Direct message lookups: conversation pages, inbox side, and unread counts
+    DDL("""
+CREATE INDEX IF NOT EXISTS idx_dm_pair_time
+    ON direct_messages (sender_id, receiver_id, sent_at)
+"""),
+    DDL("""
+CREATE INDEX IF NOT EXISTS idx_dm_receiver_time
+    ON direct_messages (receiver_id, sent_at)
+"""),
+    DDL("""
+CREATE INDEX IF NOT EXISTS idx_dm_unread
+    ON direct_messages (receiver_id, sender_id) WHERE read_at IS NULL
+"""),
+    # ON DELETE SET NULL from users looks up messages by sender
+    DDL("""
+CREATE INDEX IF NOT EXISTS idx_message_sender ON messages (sender_id)
+"""),
+    # Single-column message indexes covered by idx_message_project_time; they only cost writes
+    DDL("""
+DROP INDEX IF EXISTS ix_messages_project_id, ix_messages_sent_at
+"""),
+)
+for _ddl in _SCHEMA_UPGRADES:
+    event.listen(Base.metadata, "after_create", _ddl.execute_if(dialect="postgresql"))
 
-async def create_tables():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    print("✅ Tables created in Supabase!")
 
 if __name__ == "__main__":
-    asyncio.run(create_tables())
\ No newline at end of file
+    asyncio.run(init_db())
\ No newline at end of file
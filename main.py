@@ -13,6 +13,8 @@ from routers.skills import router as skillrouter
 from routers.upload import router as uploadrouter
 from config import FRONTEND_LINK
 from utils.scheduler import start_scheduler, stop_scheduler
+from database.initialization import warm_pool
+from utils.batch_writer import message_writer, dm_writer
 import logging
 
 # Configure logging
@@ -21,15 +23,28 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
+# Keep per-statement SQL logging out of the INFO root logger
+logging.getLogger("sqlalchemy.engine").setLevel(logging.WARNING)
+
 logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     start_scheduler()
+    message_writer.start()
+    dm_writer.start()
+    try:
+        await warm_pool()
+    except Exception as e:
+        # Not fatal - connections will be opened lazily on first use
+        logger.warning(f"Database pool warm-up failed: {e}")
     logger.info("Application started")
     yield
     # Shutdown
+    # Flush queued chat messages before exiting
+    await message_writer.stop()
+    await dm_writer.stop()
     stop_scheduler()
     logger.info("Application shutdown")
 
@@ -42,11 +57,12 @@ app = FastAPI(
 # CORS - Combined into one middleware with multiple origins
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[
+    # dict.fromkeys dedupes while keeping order (FRONTEND_LINK may equal a dev URL)
+    allow_origins=list(dict.fromkeys([
         FRONTEND_LINK,
         "http://localhost:5173",
         "http://localhost:3000"  # Add any other dev URLs
-    ],
+    ])),
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -77,4 +93,21 @@ routerlist = [authrouter,
               uploadrouter]
 
 for router in routerlist:
-    app.include_router(prefix=PREFIX, router=router)
\ No newline at end of file
+    app.include_router(prefix=PREFIX, router=router)
+
+if __name__ == "__main__":
+    import uvicorn
+    
+    # uvloop/httptools come with uvicorn[standard]; the CLI equivalent is in the readme.
+    # Per-connection deflate would recompress every broadcast once per recipient, and chat
+    # frames are small, so it's switched off
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        ws_per_message_deflate=False,
+        ws_ping_interval=20.0,  # Protocol-level keepalive; dead sockets close after the timeout
+        ws_ping_timeout=20.0
+    )
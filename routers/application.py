@@ -1,15 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, func
+from sqlalchemy import select, update, exists, and_, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from database.initialization import get_db
 from database.schemas import (
     ApplicationModel, ProjectRoleModel, ProjectMemberModel, ProjectModel,
     ApplicationStatusEnum, MemberRoleEnum, UserProfileModel
 )
 from utils.auth import get_current_user
+from utils.cache import get_profile_name
 from pydantic import BaseModel, Field
 from uuid import UUID
 from datetime import datetime, timezone
+import asyncio
 
 router = APIRouter(prefix="/applications", tags=["Applications"])
 
@@ -30,31 +34,65 @@ class ApplicationResponse(BaseModel):
     applied_at: str
     reviewed_at: str | None
 
-# Helper function to check authorization (DRY principle)
-async def check_project_authorization(project_id: UUID, user_id: UUID, db: AsyncSession) -> ProjectModel:
-    """Check if user can manage applications for this project"""
-    result = await db.execute(
-        select(ProjectModel).where(ProjectModel.id == project_id)
+# OPTIMIZATION: Listing query built once at import; endpoints only attach their filter.
+# Selects plain columns so no ORM entities are hydrated per row. Column labels match
+# ApplicationResponse fields, so a row's _asdict() is the response item - orjson
+# renders UUIDs, tz-aware datetimes (ISO 8601) and enums (by value) natively
+_APP_LIST_STMT = (
+    select(
+        ApplicationModel.id,
+        ApplicationModel.project_id,
+        ProjectModel.name.label("project_name"),
+        ApplicationModel.role_id,
+        ProjectRoleModel.role_title,
+        ApplicationModel.applicant_id,
+        UserProfileModel.name.label("applicant_name"),
+        ApplicationModel.cover_letter,
+        ApplicationModel.status,
+        ApplicationModel.applied_at,
+        ApplicationModel.reviewed_at
     )
-    project = result.scalar_one_or_none()
-    if not project:
-        raise HTTPException(404, "Project not found")
-    
-    # Creator has automatic access
-    if project.creator_id == user_id:
-        return project
-    
-    # Check if admin/parent member
-    result = await db.execute(
-        select(ProjectMemberModel).where(
+    .select_from(ApplicationModel)
+    .join(ProjectRoleModel, ApplicationModel.role_id == ProjectRoleModel.id)
+    .join(UserProfileModel, ApplicationModel.applicant_id == UserProfileModel.user_id)
+    .join(ProjectModel, ApplicationModel.project_id == ProjectModel.id)
+    .order_by(ApplicationModel.applied_at.desc())
+)
+
+async def _list_applications(db: AsyncSession, stmt) -> list[dict]:
+    """Run a listing query on the request session and return its rows as dicts"""
+    # Lists are bounded per project/user, so they're fetched in full on the request session
+    # rather than holding a second pooled connection while a slow client reads a stream
+    result = await db.execute(stmt)
+    return [row._asdict() for row in result]
+
+def _project_authz_clause(user_id: UUID):
+    """SQL predicate: user created the project or is an admin/parent member of it"""
+    return or_(
+        ProjectModel.creator_id == user_id,
+        exists().where(
             and_(
-                ProjectMemberModel.project_id == project_id,
+                ProjectMemberModel.project_id == ProjectModel.id,
                 ProjectMemberModel.user_id == user_id,
                 ProjectMemberModel.member_role.in_([MemberRoleEnum.ADMIN, MemberRoleEnum.PARENT])
             )
         )
     )
-    if not result.scalar_one_or_none():
+
+# Helper function to check authorization (DRY principle)
+async def check_project_authorization(project_id: UUID, user_id: UUID, db: AsyncSession) -> ProjectModel:
+    """Check if user can manage applications for this project"""
+    # OPTIMIZATION: Project lookup and permission check in one round-trip
+    result = await db.execute(
+        select(ProjectModel, _project_authz_clause(user_id).label("can_manage"))
+        .where(ProjectModel.id == project_id)
+    )
+    row = result.one_or_none()
+    if not row:
+        raise HTTPException(404, "Project not found")
+    
+    project, can_manage = row
+    if not can_manage:
         raise HTTPException(403, "Not authorized to manage this project")
     
     return project
@@ -65,127 +103,121 @@ async def apply_to_role(
     current_user = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    # Check if user has profile
-    result = await db.execute(
-        select(UserProfileModel).where(UserProfileModel.user_id == current_user.id)
-    )
-    profile = result.scalar_one_or_none()
-    if not profile:
-        raise HTTPException(400, "Create profile first")
-    
-    # Get role and project in one query with join
-    result = await db.execute(
-        select(ProjectRoleModel, ProjectModel)
+    # Role, project and the caller's membership in one query
+    role_query = db.execute(
+        select(
+            ProjectRoleModel.project_id,
+            ProjectRoleModel.role_title,
+            ProjectRoleModel.is_filled,
+            ProjectModel.name.label("project_name"),
+            ProjectModel.creator_id,
+            ProjectMemberModel.id.label("member_id"),
+            ProjectMemberModel.role_id.label("member_role_id")
+        )
         .join(ProjectModel, ProjectRoleModel.project_id == ProjectModel.id)
+        .outerjoin(
+            ProjectMemberModel,
+            and_(
+                ProjectMemberModel.project_id == ProjectRoleModel.project_id,
+                ProjectMemberModel.user_id == current_user.id
+            )
+        )
         .where(ProjectRoleModel.id == request.role_id)
     )
-    row = result.one_or_none()
-    if not row:
-        raise HTTPException(404, "Role not found")
     
-    role, project = row
+    # OPTIMIZATION: Profile lookup is served from a TTL cache, or runs on its own pooled
+    # connection concurrently with the role query (an AsyncSession runs one statement at a time)
+    applicant_name, result = await asyncio.gather(
+        get_profile_name(current_user.id),
+        role_query
+    )
+    
+    # Check if user has profile
+    if applicant_name is None:
+        raise HTTPException(400, "Create profile first")
+    
+    role = result.one_or_none()
+    if not role:
+        raise HTTPException(404, "Role not found")
     
     if role.is_filled:
         raise HTTPException(400, "Role is already filled")
     
     # Check if user is creator (can't apply to own project)
-    if project.creator_id == current_user.id:
+    if role.creator_id == current_user.id:
         raise HTTPException(400, "Cannot apply to your own project")
     
     # Check if already a member of this project
-    result = await db.execute(
-        select(ProjectMemberModel).where(
-            and_(
-                ProjectMemberModel.project_id == role.project_id,
-                ProjectMemberModel.user_id == current_user.id
-            )
-        )
-    )
-    existing_member = result.scalar_one_or_none()
-    if existing_member:
+    if role.member_id:
         # If they're already assigned to THIS specific role, extra protection
-        if existing_member.role_id == request.role_id:
+        if role.member_role_id == request.role_id:
             raise HTTPException(400, "You are already assigned to this role")
         else:
             raise HTTPException(400, "You are already a member of this project")
     
-    # Check if already applied to this role
+    # OPTIMIZATION: The unique (role_id, applicant_id) index replaces the "already applied"
+    # pre-check - no row comes back if an application exists
     result = await db.execute(
-        select(ApplicationModel).where(
-            and_(
-                ApplicationModel.role_id == request.role_id,
-                ApplicationModel.applicant_id == current_user.id
-            )
+        pg_insert(ApplicationModel)
+        .values(
+            project_id=role.project_id,
+            role_id=request.role_id,
+            applicant_id=current_user.id,
+            cover_letter=request.cover_letter
         )
+        .on_conflict_do_nothing(index_elements=[ApplicationModel.role_id, ApplicationModel.applicant_id])
+        .returning(ApplicationModel.id, ApplicationModel.status, ApplicationModel.applied_at)
     )
-    if result.scalar_one_or_none():
+    application = result.one_or_none()
+    if not application:
         raise HTTPException(400, "Already applied to this role")
     
-    # Create application
-    application = ApplicationModel(
-        project_id=role.project_id,
-        role_id=request.role_id,
-        applicant_id=current_user.id,
-        cover_letter=request.cover_letter
-    )
-    
-    db.add(application)
     await db.commit()
-    await db.refresh(application)
     
     return ApplicationResponse(
         id=str(application.id),
-        project_id=str(application.project_id),
-        project_name=project.name,
-        role_id=str(application.role_id),
+        project_id=str(role.project_id),
+        project_name=role.project_name,
+        role_id=str(request.role_id),
         role_title=role.role_title,
-        applicant_id=str(application.applicant_id),
-        applicant_name=profile.name,
-        cover_letter=application.cover_letter,
+        applicant_id=str(current_user.id),
+        applicant_name=applicant_name,
+        cover_letter=request.cover_letter,
         status=application.status.value,
         applied_at=application.applied_at.isoformat(),
         reviewed_at=None
     )
 
-@router.get("/project/{project_id}", response_model=list[ApplicationResponse])
+@router.get(
+    "/project/{project_id}",
+    response_class=ORJSONResponse,
+    responses={200: {"model": list[ApplicationResponse]}}
+)
 async def get_project_applications(
     project_id: UUID,
     current_user = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    # Check authorization using helper function
-    await check_project_authorization(project_id, current_user.id, db)
-    
-    # OPTIMIZED: Get applications with role and profile data in one query
-    result = await db.execute(
-        select(ApplicationModel, ProjectRoleModel, UserProfileModel, ProjectModel)
-        .join(ProjectRoleModel, ApplicationModel.role_id == ProjectRoleModel.id)
-        .join(UserProfileModel, ApplicationModel.applicant_id == UserProfileModel.user_id)
-        .join(ProjectModel, ApplicationModel.project_id == ProjectModel.id)
+    # OPTIMIZED: Get applications with role and profile data in one query,
+    # with the authorization check folded into the WHERE clause
+    applications = await _list_applications(
+        db,
+        _APP_LIST_STMT
         .where(ApplicationModel.project_id == project_id)
-        .order_by(ApplicationModel.applied_at.desc())
+        .where(_project_authz_clause(current_user.id))
     )
-    rows = result.all()
     
-    response = []
-    for app, role, profile, project in rows:
-        response.append(ApplicationResponse(
-            id=str(app.id),
-            project_id=str(app.project_id),
-            project_name=project.name,
-            role_id=str(app.role_id),
-            role_title=role.role_title,
-            applicant_id=str(app.applicant_id),
-            applicant_name=profile.name,
-            cover_letter=app.cover_letter,
-            status=app.status.value,
-            applied_at=app.applied_at.isoformat(),
-            reviewed_at=app.reviewed_at.isoformat() if app.reviewed_at else None
-        ))
+    # Empty result is either no applications or no access - only then pay for the explicit check
+    if not applications:
+        await check_project_authorization(project_id, current_user.id, db)
     
-    return response
+    return ORJSONResponse(applications)
 
-@router.get("/my-applications", response_model=list[ApplicationResponse])
+@router.get(
+    "/my-applications",
+    response_class=ORJSONResponse,
+    responses={200: {"model": list[ApplicationResponse]}}
+)
 async def get_my_applications(
     current_user = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
@@ -193,33 +225,11 @@ async def get_my_applications(
     """Get all applications submitted by the current user"""
     
     # OPTIMIZED: Get all data in one query
-    result = await db.execute(
-        select(ApplicationModel, ProjectRoleModel, UserProfileModel, ProjectModel)
-        .join(ProjectRoleModel, ApplicationModel.role_id == ProjectRoleModel.id)
-        .join(UserProfileModel, ApplicationModel.applicant_id == UserProfileModel.user_id)
-        .join(ProjectModel, ApplicationModel.project_id == ProjectModel.id)
-        .where(ApplicationModel.applicant_id == current_user.id)
-        .order_by(ApplicationModel.applied_at.desc())
+    applications = await _list_applications(
+        db, _APP_LIST_STMT.where(ApplicationModel.applicant_id == current_user.id)
     )
-    rows = result.all()
-    
-    response = []
-    for app, role, profile, project in rows:
-        response.append(ApplicationResponse(
-            id=str(app.id),
-            project_id=str(app.project_id),
-            project_name=project.name,
-            role_id=str(app.role_id),
-            role_title=role.role_title,
-            applicant_id=str(app.applicant_id),
-            applicant_name=profile.name,
-            cover_letter=app.cover_letter,
-            status=app.status.value,
-            applied_at=app.applied_at.isoformat(),
-            reviewed_at=app.reviewed_at.isoformat() if app.reviewed_at else None
-        ))
     
-    return response
+    return ORJSONResponse(applications)
 
 @router.post("/accept/{application_id}")
 async def accept_application(
@@ -230,19 +240,27 @@ async def accept_application(
     try:
         async with db.begin_nested():  # Use savepoint for transaction
             # Get application with role in one query
+            # OPTIMIZATION: Row locks serialize concurrent acceptors on the same application/role
             result = await db.execute(
-                select(ApplicationModel, ProjectRoleModel)
+                select(
+                    ApplicationModel,
+                    ProjectRoleModel,
+                    _project_authz_clause(current_user.id).label("can_manage")
+                )
                 .join(ProjectRoleModel, ApplicationModel.role_id == ProjectRoleModel.id)
+                .join(ProjectModel, ApplicationModel.project_id == ProjectModel.id)
                 .where(ApplicationModel.id == application_id)
+                .with_for_update(of=(ApplicationModel, ProjectRoleModel))
             )
             row = result.one_or_none()
             if not row:
                 raise HTTPException(404, "Application not found")
             
-            application, role = row
+            application, role, can_manage = row
             
-            # Check authorization
-            await check_project_authorization(application.project_id, current_user.id, db)
+            # Check authorization (fetched with the application above)
+            if not can_manage:
+                raise HTTPException(403, "Not authorized to manage this project")
             
             if application.status != ApplicationStatusEnum.PENDING:
                 raise HTTPException(400, f"Application already {application.status.value}")
@@ -263,6 +281,26 @@ async def accept_application(
             if result.scalar_one_or_none():
                 raise HTTPException(400, "Applicant is already a project member")
             
+            # OPTIMIZATION: Claim the slot in SQL - the guard makes it atomic and
+            # no row comes back if the role filled up in the meantime
+            result = await db.execute(
+                update(ProjectRoleModel)
+                .where(
+                    and_(
+                        ProjectRoleModel.id == application.role_id,
+                        ProjectRoleModel.slots_filled < ProjectRoleModel.slots_available
+                    )
+                )
+                .values(
+                    slots_filled=ProjectRoleModel.slots_filled + 1,
+                    is_filled=ProjectRoleModel.slots_filled + 1 >= ProjectRoleModel.slots_available
+                )
+                .returning(ProjectRoleModel.id)
+                .execution_options(synchronize_session=False)
+            )
+            if result.scalar_one_or_none() is None:
+                raise HTTPException(400, "No slots available for this role")
+            
             # Accept application
             application.status = ApplicationStatusEnum.ACCEPTED
             application.reviewed_at = datetime.now(timezone.utc)
@@ -276,29 +314,23 @@ async def accept_application(
             )
             db.add(member)
             
-            # Update role slots
-            role.slots_filled += 1
-            if role.slots_filled >= role.slots_available:
-                role.is_filled = True
-            
-            # Check if all roles filled
-            result = await db.execute(
-                select(func.count(ProjectRoleModel.id))
+            # OPTIMIZATION: Check for unfilled roles and flag the project in one statement
+            await db.execute(
+                update(ProjectModel)
                 .where(
                     and_(
-                        ProjectRoleModel.project_id == application.project_id,
-                        ProjectRoleModel.is_filled == False
+                        ProjectModel.id == application.project_id,
+                        ~exists().where(
+                            and_(
+                                ProjectRoleModel.project_id == ProjectModel.id,
+                                ProjectRoleModel.is_filled == False
+                            )
+                        )
                     )
                 )
+                .values(is_fully_staffed=True)
+                .execution_options(synchronize_session=False)
             )
-            unfilled_count = result.scalar()
-            
-            if unfilled_count == 0:
-                result = await db.execute(
-                    select(ProjectModel).where(ProjectModel.id == application.project_id)
-                )
-                project = result.scalar_one()
-                project.is_fully_staffed = True
         
         await db.commit()
         
@@ -324,14 +356,19 @@ async def reject_application(
         async with db.begin_nested():  # Use savepoint for transaction
             # Get application
             result = await db.execute(
-                select(ApplicationModel).where(ApplicationModel.id == application_id)
+                select(ApplicationModel, _project_authz_clause(current_user.id).label("can_manage"))
+                .join(ProjectModel, ApplicationModel.project_id == ProjectModel.id)
+                .where(ApplicationModel.id == application_id)
             )
-            application = result.scalar_one_or_none()
-            if not application:
+            row = result.one_or_none()
+            if not row:
                 raise HTTPException(404, "Application not found")
             
-            # Check authorization
-            await check_project_authorization(application.project_id, current_user.id, db)
+            application, can_manage = row
+            
+            # Check authorization (fetched with the application above)
+            if not can_manage:
+                raise HTTPException(403, "Not authorized to manage this project")
             
             if application.status != ApplicationStatusEnum.PENDING:
                 raise HTTPException(400, f"Application already {application.status.value}")
@@ -1,14 +1,98 @@
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, status
-from database.initialization import get_db
+from fastapi.concurrency import run_in_threadpool
+from database.initialization import get_db, AsyncSessionLocal
 from database.schemas import UserModel, RefreshTokenModel, OTPVerificationModel
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update
-from utils.email import send_otp
-from utils.auth import hash_password, create_tokens, verify_password, hash_refresh_token
+from sqlalchemy import select, update, exists, lambda_stmt, bindparam
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from utils.email import generate_otp, send_otp_email
+from utils.auth import (
+    hash_password, create_tokens, verify_password, hash_refresh_token, refresh_token_cache,
+    normalize_email, DUMMY_PASSWORD_HASH
+)
 from datetime import datetime, timezone, timedelta
+import hmac
 from pydantic import BaseModel, EmailStr, Field
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
+# OPTIMIZATION: Hot auth lookups as cached lambda statements - the expression tree and its
+# cache key are built once, each call only binds parameters
+_LOGIN_USER_STMT = lambda_stmt(
+    lambda: select(UserModel.id, UserModel.hashed_password, UserModel.is_active)
+    .where(UserModel.email == bindparam("email"))
+)
+
+# OPTIMIZATION: EXISTS lets Postgres answer from the email index without fetching the row
+_EMAIL_REGISTERED_STMT = lambda_stmt(
+    lambda: select(exists().where(UserModel.email == bindparam("email")))
+)
+
+_PENDING_OTP_STMT = lambda_stmt(
+    lambda: select(OTPVerificationModel).where(
+        OTPVerificationModel.email == bindparam("email"),
+        OTPVerificationModel.is_used == False,
+        OTPVerificationModel.expires_at > bindparam("now")
+    )
+)
+
+_REFRESH_TOKEN_STMT = lambda_stmt(
+    lambda: select(RefreshTokenModel.id, RefreshTokenModel.user_id, UserModel.is_active)
+    .join(UserModel, RefreshTokenModel.user_id == UserModel.id)
+    .where(
+        RefreshTokenModel.token_hash == bindparam("token_hash"),
+        RefreshTokenModel.is_revoked == False,
+        RefreshTokenModel.expires_at > bindparam("now")
+    )
+)
+
+_RESET_OTP_STMT = lambda_stmt(
+    lambda: select(OTPVerificationModel.id, OTPVerificationModel.otp_code, UserModel.id.label("user_id"))
+    .join(UserModel, OTPVerificationModel.email == UserModel.email)
+    .where(
+        OTPVerificationModel.email == bindparam("email"),
+        OTPVerificationModel.is_used == False,
+        OTPVerificationModel.expires_at > bindparam("now")
+    )
+)
+
+async def _store_pending_otp(
+    db: AsyncSession, email: str, otp: str, hashed_password: str | None, now: datetime
+) -> bool:
+    """Insert a pending OTP, or replace an expired one; False if a live OTP is still pending"""
+    # OPTIMIZATION: The partial unique index on pending emails turns the "pending OTP?" check
+    # and the insert into one race-free statement
+    stmt = pg_insert(OTPVerificationModel).values(
+        email=email,
+        otp_code=otp,
+        hashed_password=hashed_password,
+        expires_at=now + timedelta(minutes=5),
+        is_used=False
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[OTPVerificationModel.email],
+        index_where=OTPVerificationModel.is_used == False,
+        set_={
+            "otp_code": stmt.excluded.otp_code,
+            "hashed_password": stmt.excluded.hashed_password,
+            "expires_at": stmt.excluded.expires_at,
+            "created_at": now
+        },
+        where=OTPVerificationModel.expires_at <= now  # Only take over rows the sweep hasn't reached yet
+    ).returning(OTPVerificationModel.id)
+    
+    result = await db.execute(stmt)
+    return result.scalar_one_or_none() is not None
+
+async def _otp_pending_error(db: AsyncSession, email: str, now: datetime) -> HTTPException:
+    """Build the 429 for a still-pending OTP, with the time left on it"""
+    result = await db.execute(_PENDING_OTP_STMT, {"email": email, "now": now})
+    existing_otp = result.scalar_one_or_none()
+    remaining_seconds = (existing_otp.expires_at - now).total_seconds() if existing_otp else 0
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=f"OTP already sent. Please wait {int(remaining_seconds)} seconds before requesting a new one."
+    )
+
 class SendOTPRequest(BaseModel):
     email: EmailStr
     password: str = Field(..., min_length=8, max_length=128)
@@ -27,62 +111,37 @@ async def send_otp_route(
     Send OTP to email for account verification.
     Stores hashed password temporarily until OTP is verified.
     """
-    email = request.email.lower().strip()
+    # OPTIMIZATION: One timestamp per request, reused as the bind value in every filter
+    now = datetime.now(timezone.utc)
+    email = normalize_email(request.email)
     
     # Check if user exists
-    result = await db.execute(select(UserModel).where(UserModel.email == email))
-    if result.scalar_one_or_none():
+    result = await db.execute(_EMAIL_REGISTERED_STMT, {"email": email})
+    if result.scalar():
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
-    # OPTIMIZATION: Delete expired OTPs first, then check for valid ones
-    await db.execute(
-        update(OTPVerificationModel)
-        .where(OTPVerificationModel.expires_at <= datetime.now(timezone.utc))
-        .values(is_used=True)
-    )
-    
-    # Check for pending OTP
-    result = await db.execute(
-        select(OTPVerificationModel).where(
-            OTPVerificationModel.email == email,
-            OTPVerificationModel.is_used == False,
-            OTPVerificationModel.expires_at > datetime.now(timezone.utc)
-        )
-    )
-    existing_otp = result.scalar_one_or_none()
-    
-    if existing_otp:
-        # Calculate remaining time
-        remaining_seconds = (existing_otp.expires_at - datetime.now(timezone.utc)).total_seconds()
-        raise HTTPException(
-            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            detail=f"OTP already sent. Please wait {int(remaining_seconds)} seconds before requesting a new one."
-        )
-    
-    # Hash password using auth utility
-    hashed_password = hash_password(request.password)
+    # Hash password using auth utility (Argon2 is CPU-bound - keep it off the event loop)
+    hashed_password = await run_in_threadpool(hash_password, request.password)
     
-    # Generate and send OTP
-    otp = send_otp(bg, email)
+    # Generate OTP (pure, no I/O)
+    otp = generate_otp()
     
-    # Store OTP with hashed password
-    otp_verification = OTPVerificationModel(
-        email=email,
-        otp_code=otp,
-        hashed_password=hashed_password,
-        expires_at=datetime.now(timezone.utc) + timedelta(minutes=5)
-    )
+    # Store OTP with hashed password - refused while a live OTP is still pending
+    if not await _store_pending_otp(db, email, otp, hashed_password, now):
+        raise await _otp_pending_error(db, email, now)
     
-    db.add(otp_verification)
     await db.commit()
     
+    # OPTIMIZATION: Queue delivery last - all SMTP work happens after the response is sent
+    bg.add_task(send_otp_email, email, otp)
+    
     return SendOTPResponse(message="OTP sent to your email", email=email)
 
 class VerifyOTPRequest(BaseModel):
-    otp: str = Field(..., min_length=6, max_length=6, pattern=r'^\d{6}$')
+    otp: str = Field(..., min_length=6, max_length=6, pattern=r'^[0-9]{6}$')
 
 class VerifyOTPResponse(BaseModel):
     message: str
@@ -100,49 +159,45 @@ async def verify_otp_route(
     Verify OTP and create user account.
     Returns access and refresh tokens upon successful verification.
     """
-    email = email.lower().strip()
+    now = datetime.now(timezone.utc)
+    email = normalize_email(email)
     
-    # Find valid OTP
-    result = await db.execute(
-        select(OTPVerificationModel).where(
-            OTPVerificationModel.email == email,
-            OTPVerificationModel.otp_code == request.otp,
-            OTPVerificationModel.is_used == False,
-            OTPVerificationModel.expires_at > datetime.now(timezone.utc)
-        )
-    )
+    # Find valid OTP - looked up by email only (unique pending index), code compared in constant time
+    result = await db.execute(_PENDING_OTP_STMT, {"email": email, "now": now})
     otp_record = result.scalar_one_or_none()
     
-    if not otp_record:
+    if not otp_record or not hmac.compare_digest(otp_record.otp_code.encode(), request.otp.encode()):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid or expired OTP"
         )
     
-    # Double-check user doesn't exist (race condition protection)
-    result = await db.execute(select(UserModel).where(UserModel.email == email))
-    if result.scalar_one_or_none():
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Email already registered"
-        )
-    
     # Mark OTP as used
     otp_record.is_used = True
     
     # Create user with stored hashed password
-    new_user = UserModel(
-        email=email,
-        hashed_password=otp_record.hashed_password,
-        is_verified=True  # Mark as verified since they verified OTP
+    # OPTIMIZATION: INSERT ... RETURNING id replaces commit + refresh, and ON CONFLICT on the
+    # unique email doubles as the "user doesn't exist" check (race condition protection)
+    result = await db.execute(
+        pg_insert(UserModel)
+        .values(
+            email=email,
+            hashed_password=otp_record.hashed_password,
+            is_verified=True  # Mark as verified since they verified OTP
+        )
+        .on_conflict_do_nothing(index_elements=[UserModel.email])
+        .returning(UserModel.id)
     )
+    user_id = result.scalar_one_or_none()
+    if user_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
     
-    db.add(new_user)
+    # Generate tokens for the new user - user, OTP and refresh token commit together
+    tokens = await create_tokens(user_id, db)
     await db.commit()
-    await db.refresh(new_user)
-    
-    # Generate tokens for the new user
-    tokens = await create_tokens(new_user.id, db)
     
     return VerifyOTPResponse(
         message="Account created successfully",
@@ -164,13 +219,15 @@ async def login_route(
     Login with email and password.
     Returns access and refresh tokens upon successful authentication.
     """
-    email = request.email.lower().strip()
+    email = normalize_email(request.email)
     
-    # Find user by email
-    result = await db.execute(select(UserModel).where(UserModel.email == email))
-    user = result.scalar_one_or_none()
+    # Find user by email (OPTIMIZATION: only the columns login needs)
+    result = await db.execute(_LOGIN_USER_STMT, {"email": email})
+    user = result.one_or_none()
     
     if not user:
+        # Burn the same Argon2 time as a real check so response timing doesn't reveal the email
+        await run_in_threadpool(verify_password, DUMMY_PASSWORD_HASH, request.password)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid email or password"  # Don't reveal which field is wrong
@@ -184,7 +241,7 @@ async def login_route(
         )
     
     # Verify password
-    if not verify_password(user.hashed_password, request.password):
+    if not await run_in_threadpool(verify_password, user.hashed_password, request.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid email or password"
@@ -192,6 +249,7 @@ async def login_route(
     
     # Generate tokens
     tokens = await create_tokens(user.id, db)
+    await db.commit()
     
     return VerifyOTPResponse(
         message="Login successful",
@@ -212,20 +270,41 @@ async def refresh_tokens_route(
     Refresh access and refresh tokens using a valid refresh token.
     Invalidates the old refresh token and issues new tokens.
     """
+    now = datetime.now(timezone.utc)
+    
     # Hash the provided refresh token
     token_hash = hash_refresh_token(request.refresh_token)
     
-    # OPTIMIZATION: Get token and user in one query
-    result = await db.execute(
-        select(RefreshTokenModel, UserModel)
-        .join(UserModel, RefreshTokenModel.user_id == UserModel.id)
-        .where(
-            RefreshTokenModel.token_hash == token_hash,
-            RefreshTokenModel.is_revoked == False,
-            RefreshTokenModel.expires_at > datetime.now(timezone.utc)
+    if refresh_token_cache.pop(token_hash) is not None:
+        # OPTIMIZATION: Token was issued by this worker recently - validate and revoke it
+        # in one conditional UPDATE (the DB stays the source of truth for revocation)
+        result = await db.execute(
+            update(RefreshTokenModel)
+            .where(
+                RefreshTokenModel.token_hash == token_hash,
+                RefreshTokenModel.is_revoked == False,
+                RefreshTokenModel.expires_at > now,
+                RefreshTokenModel.user_id == UserModel.id
+            )
+            .values(is_revoked=True)
+            .returning(RefreshTokenModel.user_id, UserModel.is_active)
+            .execution_options(synchronize_session=False)
         )
-    )
-    row = result.one_or_none()
+        row = result.one_or_none()
+    else:
+        # OPTIMIZATION: Get token and user in one query
+        # OPTIMIZATION: Plain columns instead of two hydrated entities
+        result = await db.execute(_REFRESH_TOKEN_STMT, {"token_hash": token_hash, "now": now})
+        token = result.one_or_none()
+        row = None
+        if token:
+            # Revoke old refresh token by primary key
+            await db.execute(
+                update(RefreshTokenModel)
+                .where(RefreshTokenModel.id == token.id)
+                .values(is_revoked=True)
+            )
+            row = (token.user_id, token.is_active)
     
     if not row:
         raise HTTPException(
@@ -233,20 +312,18 @@ async def refresh_tokens_route(
             detail="Invalid or expired refresh token"
         )
     
-    db_token, user = row
+    user_id, is_active = row
     
     # Check if user is active
-    if not user.is_active:
+    if not is_active:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Account is deactivated"
         )
     
-    # Revoke old refresh token
-    db_token.is_revoked = True
-    
     # Generate new tokens
-    tokens = await create_tokens(db_token.user_id, db)
+    tokens = await create_tokens(user_id, db)
+    await db.commit()
 
     return VerifyOTPResponse(
         message="Tokens refreshed successfully",
@@ -267,61 +344,35 @@ async def forgot_password_route(
     """
     Send OTP to email for password reset.
     """
-    email = request.email.lower().strip()
+    now = datetime.now(timezone.utc)
+    email = normalize_email(request.email)
     
     # Check if user exists
-    result = await db.execute(select(UserModel).where(UserModel.email == email))
-    user = result.scalar_one_or_none()
+    result = await db.execute(_EMAIL_REGISTERED_STMT, {"email": email})
     
-    if not user:
+    if not result.scalar():
         # Don't reveal if email exists or not (security best practice)
         return SendOTPResponse(
             message="If the email exists, an OTP has been sent",
             email=email
         )
     
-    # OPTIMIZATION: Clean up expired OTPs
-    await db.execute(
-        update(OTPVerificationModel)
-        .where(OTPVerificationModel.expires_at <= datetime.now(timezone.utc))
-        .values(is_used=True)
-    )
-    
-    # Check for pending OTP
-    result = await db.execute(
-        select(OTPVerificationModel).where(
-            OTPVerificationModel.email == email,
-            OTPVerificationModel.is_used == False,
-            OTPVerificationModel.expires_at > datetime.now(timezone.utc)
-        )
-    )
-    existing_otp = result.scalar_one_or_none()
-    
-    if existing_otp:
-        remaining_seconds = (existing_otp.expires_at - datetime.now(timezone.utc)).total_seconds()
-        raise HTTPException(
-            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            detail=f"OTP already sent. Please wait {int(remaining_seconds)} seconds before requesting a new one."
-        )
+    # Generate OTP (pure, no I/O)
+    otp = generate_otp()
     
-    # Generate and send OTP
-    otp = send_otp(bg, email)
+    # Store OTP (no password stored yet - it is set during reset)
+    if not await _store_pending_otp(db, email, otp, None, now):
+        raise await _otp_pending_error(db, email, now)
     
-    # Store OTP (no password stored yet)
-    otp_verification = OTPVerificationModel(
-        email=email,
-        otp_code=otp,
-        hashed_password=None,  # Password will be set during reset
-        expires_at=datetime.now(timezone.utc) + timedelta(minutes=5)
-    )
-    
-    db.add(otp_verification)
     await db.commit()
+    
+    # Queue delivery only once the OTP is committed
+    bg.add_task(send_otp_email, email, otp)
 
     return SendOTPResponse(message="OTP sent to your email", email=email)
 
 class ResetPasswordRequest(BaseModel):
-    otp: str = Field(..., min_length=6, max_length=6, pattern=r'^\d{6}$')
+    otp: str = Field(..., min_length=6, max_length=6, pattern=r'^[0-9]{6}$')
     new_password: str = Field(..., min_length=8, max_length=128)
 
 @router.post("/reset-password/{email}", status_code=status.HTTP_200_OK, response_model=VerifyOTPResponse)
@@ -334,50 +385,55 @@ async def reset_password_route(
     Verify OTP and reset password.
     Revokes all existing refresh tokens for security.
     """
-    email = email.lower().strip()
+    now = datetime.now(timezone.utc)
+    email = normalize_email(email)
     
-    # OPTIMIZATION: Get OTP and user in one query
-    result = await db.execute(
-        select(OTPVerificationModel, UserModel)
-        .join(UserModel, OTPVerificationModel.email == UserModel.email)
-        .where(
-            OTPVerificationModel.email == email,
-            OTPVerificationModel.otp_code == request.otp,
-            OTPVerificationModel.is_used == False,
-            OTPVerificationModel.expires_at > datetime.now(timezone.utc)
-        )
-    )
+    # OPTIMIZATION: Get OTP and user ids in one query
+    result = await db.execute(_RESET_OTP_STMT, {"email": email, "now": now})
     row = result.one_or_none()
     
-    if not row:
+    # Code compared in constant time rather than in the WHERE clause
+    if not row or not hmac.compare_digest(row.otp_code.encode(), request.otp.encode()):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid or expired OTP"
         )
     
-    otp_record, user = row
+    otp_id, _, user_id = row
     
     # Mark OTP as used
-    otp_record.is_used = True
+    await db.execute(
+        update(OTPVerificationModel)
+        .where(OTPVerificationModel.id == otp_id)
+        .values(is_used=True)
+    )
     
     # Update user password
-    user.hashed_password = hash_password(request.new_password)
-
-    # OPTIMIZATION: Revoke all refresh tokens in single query
+    hashed_password = await run_in_threadpool(hash_password, request.new_password)
     await db.execute(
+        update(UserModel)
+        .where(UserModel.id == user_id)
+        .values(hashed_password=hashed_password)
+    )
+
+    # OPTIMIZATION: Revoke all refresh tokens in single query; RETURNING hands back the
+    # hashes so their cached hints are dropped without another SELECT
+    result = await db.execute(
         update(RefreshTokenModel)
         .where(
-            RefreshTokenModel.user_id == user.id,
+            RefreshTokenModel.user_id == user_id,
             RefreshTokenModel.is_revoked == False
         )
         .values(is_revoked=True)
+        .returning(RefreshTokenModel.token_hash)
     )
+    for revoked_hash in result.scalars():
+        refresh_token_cache.pop(revoked_hash)
     
+    # Generate new tokens (committed together with the password change)
+    tokens = await create_tokens(user_id, db)
     await db.commit()
     
-    # Generate new tokens
-    tokens = await create_tokens(user.id, db)
-    
     return VerifyOTPResponse(
         message="Password reset successfully",
         access_token=tokens["access_token"],
@@ -385,23 +441,29 @@ async def reset_password_route(
         token_type=tokens["token_type"]
     )
 
+async def _revoke_refresh_token(token_hash: str):
+    """Revoke a refresh token on a short-lived session (runs after the response)"""
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(RefreshTokenModel)
+            .where(RefreshTokenModel.token_hash == token_hash)
+            .values(is_revoked=True)
+        )
+        await db.commit()
+
 @router.post("/logout")
 async def logout_route(
     request: RefreshTokenRequest,
-    db: AsyncSession = Depends(get_db)
+    bg: BackgroundTasks
 ):
     """
     Logout by revoking the refresh token.
     """
     token_hash = hash_refresh_token(request.refresh_token)
     
-    # Revoke the refresh token
-    await db.execute(
-        update(RefreshTokenModel)
-        .where(RefreshTokenModel.token_hash == token_hash)
-        .values(is_revoked=True)
-    )
-    
-    await db.commit()
+    # OPTIMIZATION: Drop the cached hint now and revoke in the background - the client
+    # discards the token anyway, so it doesn't need to wait for the write
+    refresh_token_cache.pop(token_hash)
+    bg.add_task(_revoke_refresh_token, token_hash)
     
-    return {"message": "Logged out successfully"}
\ No newline at end of file
+    return {"message": "Logged out successfully"}
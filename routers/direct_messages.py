@@ -1,16 +1,22 @@
 from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, Query
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, or_
-from database.initialization import get_db, AsyncSessionLocal
-from database.schemas import DirectMessageModel, UserProfileModel
-from utils.auth import get_current_user
+from sqlalchemy import select, update, and_, or_, case, func, text
+from database.initialization import get_db
+from database.schemas import DirectMessageModel, DMConversationModel, UserProfileModel
+from utils.auth import get_current_user, decode_access_token
+from utils.cache import get_profile_name
+from utils.batch_writer import dm_writer
+from utils.websocket import (
+    ConnectionWriter, encode, frame, PONG_FRAME, TOKEN_REQUIRED_FRAME, INVALID_TOKEN_FRAME
+)
 from pydantic import BaseModel
-from uuid import UUID
+from uuid import UUID, uuid4
 from datetime import datetime, timezone
-from jose import jwt, JWTError
-from config import SECRET_KEY, ALGORITHM
+from jwt import InvalidTokenError as JWTError
 import asyncio
 import logging
+import orjson
 
 logger = logging.getLogger(__name__)
 
@@ -19,41 +25,54 @@ router = APIRouter(prefix="/dm", tags=["Direct Messages"])
 # Connection manager for DM WebSockets
 class DMConnectionManager:
     def __init__(self):
-        self.active_connections: dict[str, list[WebSocket]] = {}
+        # OPTIMIZATION: One dict of devices per user, so dropping a device is a single pop
+        self.active_connections: dict[str, dict[WebSocket, ConnectionWriter]] = {}
     
     async def connect(self, user_id: str, websocket: WebSocket):
-        if user_id not in self.active_connections:
-            self.active_connections[user_id] = []
-        self.active_connections[user_id].append(websocket)
+        self.active_connections.setdefault(user_id, {})[websocket] = ConnectionWriter(websocket)
         logger.info(f"User {user_id} connected to DM")
     
     def disconnect(self, user_id: str, websocket: WebSocket):
-        if user_id in self.active_connections:
-            self.active_connections[user_id] = [
-                ws for ws in self.active_connections[user_id] if ws != websocket
-            ]
-            if not self.active_connections[user_id]:
-                del self.active_connections[user_id]
+        connections = self.active_connections.get(user_id)
+        if connections is None:
+            return
+        writer = connections.pop(websocket, None)
+        if writer is not None:
+            writer.close()
+        if not connections:
+            del self.active_connections[user_id]
     
-    async def send_to_user(self, user_id: str, message: dict):
-        if user_id in self.active_connections:
-            disconnected = []
-            for websocket in self.active_connections[user_id]:
-                try:
-                    await websocket.send_json(message)
-                except Exception as e:
-                    logger.error(f"Error sending DM to {user_id}: {e}")
-                    disconnected.append(websocket)
-            
-            for ws in disconnected:
+    def send_to_user(self, user_id: str, message: dict | str):
+        """Queue a message (dict or already-encoded JSON) on every device of a user"""
+        # Copied first: dropping a stalled device below removes it from the user's dict
+        connections = tuple(self.active_connections.get(user_id, {}).items())
+        if not connections:
+            return
+        
+        # OPTIMIZATION: Encode once and queue on each device's writer task
+        payload = message if isinstance(message, str) else encode(message)
+        for ws, writer in connections:
+            if not writer.send(payload):
                 self.disconnect(user_id, ws)
     
+    def send_to_socket(self, user_id: str, websocket: WebSocket, message: dict | str):
+        """Queue a message on one socket behind anything already pending for it"""
+        writer = self.active_connections.get(user_id, {}).get(websocket)
+        payload = message if isinstance(message, str) else encode(message)
+        if writer is not None and not writer.send(payload):
+            self.disconnect(user_id, websocket)
+    
     def is_online(self, user_id: str) -> bool:
         return user_id in self.active_connections
 
 # Initialize DM manager
 dm_manager = DMConnectionManager()
 
+# Error replies for the DM socket
+_TOO_LONG_FRAME = frame({"error": "Message too long"})
+_INVALID_RECEIVER_FRAME = frame({"error": "Invalid receiver"})
+_SEND_FAILED_FRAME = frame({"error": "Message could not be sent"})
+
 class DirectMessageResponse(BaseModel):
     id: str
     sender_id: str
@@ -79,104 +98,114 @@ async def dm_websocket_endpoint(websocket: WebSocket):
         token = auth_data.get("token")
         
         if not token:
-            await websocket.send_json({"error": "Token required"})
+            await websocket.send(TOKEN_REQUIRED_FRAME)
             await websocket.close()
             return
         
         # Verify token
         try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            user_id = UUID(payload["sub"])
+            user_id = decode_access_token(token)
         except (JWTError, ValueError, KeyError) as e:
             logger.warning(f"Invalid token in DM WebSocket: {e}")
-            await websocket.send_json({"error": "Invalid token"})
+            await websocket.send(INVALID_TOKEN_FRAME)
             await websocket.close()
             return
         
-        # Get user profile
-        async with AsyncSessionLocal() as db:
-            result = await db.execute(
-                select(UserProfileModel).where(UserProfileModel.user_id == user_id)
-            )
-            profile = result.scalar_one_or_none()
-            sender_name = profile.name if profile else "Unknown"
+        # Get user profile name (cached across reconnects, dropped on profile update)
+        sender_name = await get_profile_name(user_id) or "Unknown"
         
         # Connect to DM system
-        await dm_manager.connect(str(user_id), websocket)
+        user_id_str = str(user_id)
+        await dm_manager.connect(user_id_str, websocket)
         connected = True
         
-        await websocket.send_json({
+        await websocket.send_text(encode({
             "type": "connected",
-            "user_id": str(user_id)
-        })
+            "user_id": user_id_str
+        }))
         
-        # Message loop
-        while True:
-            try:
-                data = await asyncio.wait_for(websocket.receive_json(), timeout=60.0)
-                
-                # Ping/pong
-                if data.get("type") == "ping":
-                    await websocket.send_json({"type": "pong"})
-                    continue
-                
-                # Typing indicator
-                if data.get("type") == "typing":
-                    receiver_id = data.get("receiver_id")
-                    if receiver_id:
-                        await dm_manager.send_to_user(receiver_id, {
-                            "type": "typing",
-                            "sender_id": str(user_id),
-                            "sender_name": sender_name,
-                            "is_typing": data.get("is_typing", True)
-                        })
-                    continue
-                
-                # Direct message
+        # Message loop - keepalive is the server's protocol-level ping, no per-receive timer
+        async for text in websocket.iter_text():
+            data = orjson.loads(text)
+            
+            # Ping/pong
+            if data.get("type") == "ping":
+                await websocket.send(PONG_FRAME)
+                continue
+            
+            # Typing indicator
+            if data.get("type") == "typing":
                 receiver_id = data.get("receiver_id")
-                content = data.get("content")
-                
-                if not receiver_id or not content:
-                    continue
-                
-                if len(content) > 5000:
-                    await websocket.send_json({"error": "Message too long"})
-                    continue
-                
-                # Save to database
-                async with AsyncSessionLocal() as db:
-                    dm = DirectMessageModel(
-                        sender_id=user_id,
-                        receiver_id=UUID(receiver_id),
-                        content=content.strip()
-                    )
-                    db.add(dm)
-                    await db.commit()
-                    await db.refresh(dm)
-                    
-                    message_data = {
-                        "type": "message",
-                        "id": str(dm.id),
-                        "sender_id": str(user_id),
+                if receiver_id:
+                    dm_manager.send_to_user(receiver_id, {
+                        "type": "typing",
+                        "sender_id": user_id_str,
                         "sender_name": sender_name,
-                        "receiver_id": receiver_id,
-                        "content": dm.content,
-                        "sent_at": dm.sent_at.isoformat(),
-                        "read_at": None,
-                        "is_deleted": False
-                    }
-                    
-                    # Send to receiver
-                    await dm_manager.send_to_user(receiver_id, message_data)
-                    
-                    # Confirm to sender
-                    await websocket.send_json({
-                        "type": "sent",
-                        "message": message_data
+                        "is_typing": data.get("is_typing", True)
                     })
+                continue
+            
+            # Direct message
+            receiver_id = data.get("receiver_id")
+            content = data.get("content")
+            
+            if not receiver_id or not content:
+                continue
+            
+            if len(content) > 5000:
+                await websocket.send(_TOO_LONG_FRAME)
+                continue
+            
+            try:
+                receiver_uuid = UUID(receiver_id)
+            except (ValueError, TypeError, AttributeError):
+                await websocket.send(_INVALID_RECEIVER_FRAME)
+                continue
+            
+            # Save to database
+            # OPTIMIZATION: id and sent_at are set here, so no refresh round trip after the insert
+            dm = DirectMessageModel(
+                id=uuid4(),
+                sender_id=user_id,
+                receiver_id=receiver_uuid,
+                content=content.strip(),
+                sent_at=datetime.now(timezone.utc)
+            )
+            # OPTIMIZATION: Inserted by the shared batch writer, so bursts from every socket
+            # share a transaction; delivery waits for the commit
+            try:
+                await dm_writer.submit(dm)
+            except Exception:
+                # Already logged by the writer; the socket stays usable
+                await websocket.send(_SEND_FAILED_FRAME)
+                continue
+            
+            # UUIDs and the timestamp are left to orjson when the frames are encoded
+            message_data = {
+                "type": "message",
+                "id": dm.id,
+                "sender_id": user_id,
+                "sender_name": sender_name,
+                "receiver_id": receiver_id,
+                "content": dm.content,
+                "sent_at": dm.sent_at,
+                "read_at": None,
+                "is_deleted": False
+            }
+            
+            # OPTIMIZATION: Delivery and the sender's ack are queued on the writer tasks,
+            # so the loop goes straight back to receiving. The message is encoded once and
+            # the ack wraps the same JSON text
+            payload = encode(message_data)
+            
+            # Send to receiver
+            dm_manager.send_to_user(receiver_id, payload)
             
-            except asyncio.TimeoutError:
-                await websocket.send_json({"type": "ping"})
+            # Confirm to sender
+            dm_manager.send_to_socket(user_id_str, websocket, '{"type":"sent","message":' + payload + '}')
+        
+        # iter_text ends quietly when the client disconnects
+        logger.info(f"DM WebSocket disconnected for user {user_id}")
     
     except asyncio.TimeoutError:
         logger.warning(f"DM WebSocket timeout for user {user_id}")
@@ -186,7 +215,7 @@ async def dm_websocket_endpoint(websocket: WebSocket):
         logger.error(f"DM WebSocket error: {e}", exc_info=True)
     finally:
         if connected:
-            dm_manager.disconnect(str(user_id), websocket)
+            dm_manager.disconnect(user_id_str, websocket)
 
 
 @router.get("/online/{user_id}")
@@ -201,7 +230,11 @@ async def check_user_online(
     }
 
 
-@router.get("/conversations/{other_user_id}", response_model=list[DirectMessageResponse])
+@router.get(
+    "/conversations/{other_user_id}",
+    response_class=ORJSONResponse,
+    responses={200: {"model": list[DirectMessageResponse]}}
+)
 async def get_dm_conversation(
     other_user_id: UUID,
     limit: int = Query(default=50, ge=1, le=200),
@@ -211,9 +244,18 @@ async def get_dm_conversation(
 ):
     """Get DM conversation history with another user. Supports pagination."""
     
-    # OPTIMIZATION: Get messages with sender profiles in one query
+    # OPTIMIZATION: Get messages with sender names in one query, as plain columns
     stmt = (
-        select(DirectMessageModel, UserProfileModel)
+        select(
+            DirectMessageModel.id,
+            DirectMessageModel.sender_id,
+            DirectMessageModel.receiver_id,
+            DirectMessageModel.content,
+            DirectMessageModel.sent_at,
+            DirectMessageModel.read_at,
+            DirectMessageModel.is_deleted,
+            UserProfileModel.name.label("sender_name")
+        )
         .outerjoin(UserProfileModel, DirectMessageModel.sender_id == UserProfileModel.user_id)
         .where(
             or_(
@@ -231,33 +273,39 @@ async def get_dm_conversation(
     
     # Pagination support
     if before_id:
-        result_before = await db.execute(
-            select(DirectMessageModel.sent_at).where(DirectMessageModel.id == before_id)
+        # OPTIMIZATION: The cursor's timestamp is a subquery of the page query, so paging back
+        # costs one statement; an unknown id leaves the page unfiltered
+        before_timestamp = (
+            select(DirectMessageModel.sent_at)
+            .where(DirectMessageModel.id == before_id)
+            .correlate(None)
+            .scalar_subquery()
+        )
+        stmt = stmt.where(
+            DirectMessageModel.sent_at < func.coalesce(before_timestamp, text("'infinity'::timestamptz"))
         )
-        before_timestamp = result_before.scalar_one_or_none()
-        if before_timestamp:
-            stmt = stmt.where(DirectMessageModel.sent_at < before_timestamp)
-    
-    stmt = stmt.order_by(DirectMessageModel.sent_at.desc()).limit(limit)
     
-    result = await db.execute(stmt)
-    rows = result.all()
+    # Newest page first, then flipped back to chronological order in SQL
+    page = stmt.order_by(DirectMessageModel.sent_at.desc()).limit(limit).subquery()
+    stmt = select(page).order_by(page.c.sent_at.asc())
     
-    # Build response (reverse to get chronological order)
-    response = []
-    for dm, profile in reversed(rows):
-        response.append(DirectMessageResponse(
-            id=str(dm.id),
-            sender_id=str(dm.sender_id),
-            receiver_id=str(dm.receiver_id),
-            sender_name=profile.name if profile else "Unknown User",
-            content=dm.content if not dm.is_deleted else "[Message deleted]",
-            sent_at=dm.sent_at.isoformat(),
-            read_at=dm.read_at.isoformat() if dm.read_at else None,
-            is_deleted=dm.is_deleted
-        ))
+    # A page is capped at 200 rows, so fetch it whole and release the connection
+    rows = (await db.execute(stmt)).all()
+    response = [
+        {
+            "id": row.id,
+            "sender_id": row.sender_id,
+            "receiver_id": row.receiver_id,
+            "sender_name": row.sender_name or "Unknown User",
+            "content": row.content if not row.is_deleted else "[Message deleted]",
+            "sent_at": row.sent_at,
+            "read_at": row.read_at,
+            "is_deleted": row.is_deleted
+        }
+        for row in rows
+    ]
     
-    return response
+    return ORJSONResponse(response)
 
 
 @router.get("/conversations")
@@ -267,63 +315,64 @@ async def get_dm_conversations_list(
 ):
     """Get list of all DM conversations with last message preview"""
     
-    # Get all unique users the current user has conversed with
+    # OPTIMIZATION: One precomputed row per conversation partner (kept current by a trigger
+    # on direct_messages), with the partner's profile joined in - no history scan, no N+1
+    other_user_id = case(
+        (DMConversationModel.user_a == current_user.id, DMConversationModel.user_b),
+        else_=DMConversationModel.user_a
+    )
     result = await db.execute(
-        select(DirectMessageModel)
+        select(
+            other_user_id.label("other_user_id"),
+            DMConversationModel.last_sender_id,
+            DMConversationModel.last_content,
+            DMConversationModel.last_is_deleted,
+            DMConversationModel.last_sent_at,
+            UserProfileModel.name,
+            UserProfileModel.profile_photo_url
+        )
+        .outerjoin(UserProfileModel, other_user_id == UserProfileModel.user_id)
         .where(
             or_(
-                DirectMessageModel.sender_id == current_user.id,
-                DirectMessageModel.receiver_id == current_user.id
+                DMConversationModel.user_a == current_user.id,
+                DMConversationModel.user_b == current_user.id
             )
         )
-        .order_by(DirectMessageModel.sent_at.desc())
+        .order_by(DMConversationModel.last_sent_at.desc())
     )
-    all_messages = result.scalars().all()
+    latest = result.all()
     
-    # Build conversations map with last message
-    conversations = {}
-    for dm in all_messages:
-        other_user_id = dm.receiver_id if dm.sender_id == current_user.id else dm.sender_id
-        
-        if other_user_id not in conversations:
-            conversations[other_user_id] = {
-                "other_user_id": str(other_user_id),
-                "last_message": dm.content if not dm.is_deleted else "[Message deleted]",
-                "last_message_at": dm.sent_at.isoformat(),
-                "last_message_from_me": dm.sender_id == current_user.id,
-                "unread_count": 0
-            }
+    if not latest:
+        return {"conversations": []}
     
-    # Get unread counts
-    for other_user_id in conversations.keys():
-        result = await db.execute(
-            select(DirectMessageModel)
-            .where(
-                and_(
-                    DirectMessageModel.sender_id == other_user_id,
-                    DirectMessageModel.receiver_id == current_user.id,
-                    DirectMessageModel.read_at.is_(None)
-                )
+    # Unread counts for every partner in one GROUP BY
+    result = await db.execute(
+        select(DirectMessageModel.sender_id, func.count())
+        .where(
+            and_(
+                DirectMessageModel.receiver_id == current_user.id,
+                DirectMessageModel.read_at.is_(None)
             )
         )
-        unread = result.scalars().all()
-        conversations[other_user_id]["unread_count"] = len(unread)
+        .group_by(DirectMessageModel.sender_id)
+    )
+    unread_counts = dict(result.all())
     
-    # Get user profiles
-    user_ids = list(conversations.keys())
-    if user_ids:
-        result = await db.execute(
-            select(UserProfileModel).where(UserProfileModel.user_id.in_(user_ids))
-        )
-        profiles = {p.user_id: p for p in result.scalars().all()}
-        
-        for other_user_id, conv in conversations.items():
-            profile = profiles.get(other_user_id)
-            if profile:
-                conv["other_user_name"] = profile.name
-                conv["other_user_photo"] = profile.profile_photo_url
+    conversations = []
+    for row in latest:
+        conv = {
+            "other_user_id": str(row.other_user_id),
+            "last_message": row.last_content if not row.last_is_deleted else "[Message deleted]",
+            "last_message_at": row.last_sent_at.isoformat(),
+            "last_message_from_me": row.last_sender_id == current_user.id,
+            "unread_count": unread_counts.get(row.other_user_id, 0)
+        }
+        if row.name is not None:
+            conv["other_user_name"] = row.name
+            conv["other_user_photo"] = row.profile_photo_url
+        conversations.append(conv)
     
-    return {"conversations": list(conversations.values())}
+    return {"conversations": conversations}
 
 
 @router.post("/mark-read/{other_user_id}")
@@ -334,8 +383,9 @@ async def mark_messages_as_read(
 ):
     """Mark all messages from a specific user as read"""
     
+    # OPTIMIZATION: One bulk UPDATE instead of loading every unread row and flushing an UPDATE per row
     result = await db.execute(
-        select(DirectMessageModel)
+        update(DirectMessageModel)
         .where(
             and_(
                 DirectMessageModel.sender_id == other_user_id,
@@ -343,23 +393,20 @@ async def mark_messages_as_read(
                 DirectMessageModel.read_at.is_(None)
             )
         )
+        .values(read_at=datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)
     )
-    unread_messages = result.scalars().all()
-    
-    now = datetime.now(timezone.utc)
-    for msg in unread_messages:
-        msg.read_at = now
-    
+    marked = result.rowcount
     await db.commit()
     
     # Notify sender that messages were read
-    await dm_manager.send_to_user(str(other_user_id), {
+    dm_manager.send_to_user(str(other_user_id), {
         "type": "messages_read",
         "reader_id": str(current_user.id),
-        "count": len(unread_messages)
+        "count": marked
     })
     
-    return {"message": f"Marked {len(unread_messages)} messages as read"}
+    return {"message": f"Marked {marked} messages as read"}
 
 
 @router.delete("/messages/{message_id}")
@@ -388,7 +435,7 @@ async def delete_dm(
     await db.commit()
     
     # Notify receiver about deletion
-    await dm_manager.send_to_user(str(dm.receiver_id), {
+    dm_manager.send_to_user(str(dm.receiver_id), {
         "type": "message_deleted",
         "message_id": str(message_id)
     })
@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, func
+from sqlalchemy import select, update, delete, exists, and_, or_, func
+from sqlalchemy.orm import raiseload
 from database.initialization import get_db
 from database.schemas import (
     ProjectModel, ProjectMemberModel, ProjectRoleModel, ProjectStatusEnum, 
-    MemberRoleEnum, UserProfileModel
+    MemberRoleEnum, UserProfileModel, MessageModel, ApplicationModel, ApplicationStatusEnum
 )
 from utils.auth import get_current_user
 from pydantic import BaseModel
@@ -31,32 +33,69 @@ class MemberResponse(BaseModel):
 # Helper function for authorization check (DRY)
 async def check_admin_authorization(project_id: UUID, user_id: UUID, db: AsyncSession):
     """Check if user is admin of the project"""
+    # OPTIMIZATION: EXISTS - the DB stops at the first match and no row is hydrated
     result = await db.execute(
-        select(ProjectMemberModel).where(
+        select(exists().where(
             and_(
                 ProjectMemberModel.project_id == project_id,
                 ProjectMemberModel.user_id == user_id,
                 ProjectMemberModel.member_role == MemberRoleEnum.ADMIN
             )
-        )
+        ))
     )
-    if not result.scalar_one_or_none():
+    if not result.scalar():
         raise HTTPException(403, "Only admins can perform this action")
 
 async def check_parent_or_admin_authorization(project_id: UUID, user_id: UUID, db: AsyncSession):
     """Check if user is parent or admin of the project"""
     result = await db.execute(
-        select(ProjectMemberModel).where(
+        select(exists().where(
             and_(
                 ProjectMemberModel.project_id == project_id,
                 ProjectMemberModel.user_id == user_id,
                 ProjectMemberModel.member_role.in_([MemberRoleEnum.PARENT, MemberRoleEnum.ADMIN])
             )
-        )
+        ))
     )
-    if not result.scalar_one_or_none():
+    if not result.scalar():
         raise HTTPException(403, "Only parents and admins can perform this action")
 
+async def _release_role_slot(db: AsyncSession, project_id: UUID, role_id: UUID) -> str | None:
+    """Give back one slot of a role and clear the project's fully-staffed flag if needed"""
+    # OPTIMIZATION: Decrement in SQL so concurrent removals can't both write the same count
+    freed_slots = func.greatest(ProjectRoleModel.slots_filled - 1, 0)  # Prevent negative
+    result = await db.execute(
+        update(ProjectRoleModel)
+        .where(ProjectRoleModel.id == role_id)
+        .values(
+            slots_filled=freed_slots,
+            is_filled=freed_slots >= ProjectRoleModel.slots_available
+        )
+        .returning(ProjectRoleModel.role_title)
+        .execution_options(synchronize_session=False)
+    )
+    role_title = result.scalar_one_or_none()
+    
+    # Project is no longer fully staffed once any of its roles has an open slot
+    await db.execute(
+        update(ProjectModel)
+        .where(
+            and_(
+                ProjectModel.id == project_id,
+                ProjectModel.is_fully_staffed == True,
+                exists().where(
+                    and_(
+                        ProjectRoleModel.project_id == project_id,
+                        ProjectRoleModel.is_filled == False
+                    )
+                )
+            )
+        )
+        .values(is_fully_staffed=False)
+        .execution_options(synchronize_session=False)
+    )
+    return role_title
+
 @router.put("/project/{project_id}/status")
 async def update_project_status(
     project_id: UUID,
@@ -66,36 +105,43 @@ async def update_project_status(
 ):
     """Update project status. Only PARENT or ADMIN can do this."""
     
-    # OPTIMIZATION: Get project and check authorization in one query
+    # OPTIMIZATION: Authorization and the update in one statement. The locked subquery
+    # hands back the pre-update status so no separate SELECT is needed
+    old = (
+        select(ProjectModel.id, ProjectModel.status)
+        .where(ProjectModel.id == project_id)
+        .with_for_update()
+        .subquery()
+    )
     result = await db.execute(
-        select(ProjectModel, ProjectMemberModel)
-        .outerjoin(
-            ProjectMemberModel,
-            and_(
-                ProjectMemberModel.project_id == ProjectModel.id,
-                ProjectMemberModel.user_id == current_user.id
+        update(ProjectModel)
+        .where(ProjectModel.id == old.c.id)
+        .where(
+            or_(
+                ProjectModel.creator_id == current_user.id,
+                exists().where(
+                    and_(
+                        ProjectMemberModel.project_id == project_id,
+                        ProjectMemberModel.user_id == current_user.id,
+                        ProjectMemberModel.member_role.in_([MemberRoleEnum.PARENT, MemberRoleEnum.ADMIN])
+                    )
+                )
             )
         )
-        .where(ProjectModel.id == project_id)
+        .values(status=request.status, last_status_update=datetime.now(timezone.utc))
+        .returning(old.c.status)
+        .execution_options(synchronize_session=False)
     )
-    row = result.one_or_none()
-    
-    if not row:
-        raise HTTPException(404, "Project not found")
-    
-    project, member = row
-    
-    # Check authorization
-    if not member or member.member_role not in [MemberRoleEnum.PARENT, MemberRoleEnum.ADMIN]:
-        # Check if creator
-        if project.creator_id != current_user.id:
-            raise HTTPException(403, "Only parents and admins can update status")
+    old_status = result.scalar_one_or_none()
     
-    old_status = project.status
-    
-    # Update status
-    project.status = request.status
-    project.last_status_update = datetime.now(timezone.utc)
+    if old_status is None:
+        # Nothing updated - work out why
+        result = await db.execute(
+            select(exists().where(ProjectModel.id == project_id))
+        )
+        if not result.scalar():
+            raise HTTPException(404, "Project not found")
+        raise HTTPException(403, "Only parents and admins can update status")
     
     await db.commit()
     
@@ -156,7 +202,11 @@ async def promote_member(
         "new_role": request.member_role.value
     }
 
-@router.get("/project/{project_id}/members", response_model=list[MemberResponse])
+@router.get(
+    "/project/{project_id}/members",
+    response_class=ORJSONResponse,
+    responses={200: {"model": list[MemberResponse]}}
+)
 async def get_project_members(
     project_id: UUID,
     current_user = Depends(get_current_user),
@@ -166,14 +216,14 @@ async def get_project_members(
     
     # Check if user is member
     result = await db.execute(
-        select(ProjectMemberModel).where(
+        select(exists().where(
             and_(
                 ProjectMemberModel.project_id == project_id,
                 ProjectMemberModel.user_id == current_user.id
             )
-        )
+        ))
     )
-    if not result.scalar_one_or_none():
+    if not result.scalar():
         raise HTTPException(403, "Not a member of this project")
     
     # OPTIMIZATION: Get all members with profiles and roles in one query
@@ -182,27 +232,28 @@ async def get_project_members(
         .join(UserProfileModel, ProjectMemberModel.user_id == UserProfileModel.user_id)
         .outerjoin(ProjectRoleModel, ProjectMemberModel.role_id == ProjectRoleModel.id)
         .where(ProjectMemberModel.project_id == project_id)
+        .options(raiseload("*"))  # Everything needed is joined; fail loudly on a stray lazy load
         .order_by(
             # Order: ADMIN first, then PARENT, then CHILD
             ProjectMemberModel.member_role.desc(),
             ProjectMemberModel.joined_at.asc()
         )
     )
-    rows = result.all()
-    
-    response = []
-    for member, profile, role in rows:
-        response.append(MemberResponse(
-            user_id=str(member.user_id),
-            name=profile.name,
-            profession=profile.profession,
-            profile_photo_url=profile.profile_photo_url,
-            member_role=member.member_role.value,
-            role_title=role.role_title if role else None,
-            joined_at=member.joined_at.isoformat()
-        ))
     
-    return response
+    # OPTIMIZATION: Each joined (member, profile, role) row maps straight to one entry;
+    # ORJSONResponse encodes the UUIDs and joined_at without a response model pass
+    return ORJSONResponse([
+        {
+            "user_id": member.user_id,
+            "name": profile.name,
+            "profession": profile.profession,
+            "profile_photo_url": profile.profile_photo_url,
+            "member_role": member.member_role.value,
+            "role_title": role.role_title if role else None,
+            "joined_at": member.joined_at
+        }
+        for member, profile, role in result
+    ])
 
 @router.delete("/project/{project_id}/member/{user_id}")
 async def remove_member(
@@ -220,60 +271,45 @@ async def remove_member(
     # Check authorization
     await check_admin_authorization(project_id, current_user.id, db)
     
-    # OPTIMIZATION: Get member and their role in one query
+    # OPTIMIZATION: Delete straight away and get the freed role back; the admin guard
+    # lives in the WHERE clause
     result = await db.execute(
-        select(ProjectMemberModel, ProjectRoleModel)
-        .outerjoin(ProjectRoleModel, ProjectMemberModel.role_id == ProjectRoleModel.id)
+        delete(ProjectMemberModel)
         .where(
             and_(
                 ProjectMemberModel.project_id == project_id,
-                ProjectMemberModel.user_id == user_id
+                ProjectMemberModel.user_id == user_id,
+                ProjectMemberModel.member_role != MemberRoleEnum.ADMIN
             )
         )
+        .returning(ProjectMemberModel.role_id)
+        .execution_options(synchronize_session=False)
     )
     row = result.one_or_none()
     
     if not row:
-        raise HTTPException(404, "Member not found")
-    
-    member, role = row
-    
-    # Can't remove admin
-    if member.member_role == MemberRoleEnum.ADMIN:
-        raise HTTPException(400, "Cannot remove admin from project")
-    
-    # Update role slots if they had a role
-    if role:
-        role.slots_filled = max(0, role.slots_filled - 1)  # Prevent negative
-        role.is_filled = role.slots_filled >= role.slots_available
-        
-        # Check if project should be marked as not fully staffed
+        # Nothing deleted - either not a member or the admin
         result = await db.execute(
-            select(func.count(ProjectRoleModel.id))
-            .where(
+            select(exists().where(
                 and_(
-                    ProjectRoleModel.project_id == project_id,
-                    ProjectRoleModel.is_filled == False
+                    ProjectMemberModel.project_id == project_id,
+                    ProjectMemberModel.user_id == user_id
                 )
-            )
+            ))
         )
-        unfilled_count = result.scalar()
-        
-        if unfilled_count > 0:
-            result = await db.execute(
-                select(ProjectModel).where(ProjectModel.id == project_id)
-            )
-            project = result.scalar_one()
-            project.is_fully_staffed = False
+        if not result.scalar():
+            raise HTTPException(404, "Member not found")
+        raise HTTPException(400, "Cannot remove admin from project")
+    
+    # Update role slots if they had a role
+    role_title = await _release_role_slot(db, project_id, row.role_id) if row.role_id else None
     
-    # Delete member
-    await db.delete(member)
     await db.commit()
     
     return {
         "message": "Member removed successfully",
         "user_id": str(user_id),
-        "role_freed": role.role_title if role else None
+        "role_freed": role_title
     }
 
 @router.post("/project/{project_id}/leave")
@@ -284,51 +320,46 @@ async def leave_project(
 ):
     """Leave a project. Can't leave if you're the admin."""
     
-    # Get member and role in one query
+    # OPTIMIZATION: Delete straight away and get the freed role back; admins and the
+    # creator are excluded in the WHERE clause
     result = await db.execute(
-        select(ProjectMemberModel, ProjectRoleModel, ProjectModel)
-        .outerjoin(ProjectRoleModel, ProjectMemberModel.role_id == ProjectRoleModel.id)
-        .join(ProjectModel, ProjectMemberModel.project_id == ProjectModel.id)
+        delete(ProjectMemberModel)
         .where(
             and_(
                 ProjectMemberModel.project_id == project_id,
-                ProjectMemberModel.user_id == current_user.id
+                ProjectMemberModel.user_id == current_user.id,
+                ProjectMemberModel.member_role != MemberRoleEnum.ADMIN,
+                ~exists().where(
+                    and_(
+                        ProjectModel.id == project_id,
+                        ProjectModel.creator_id == current_user.id
+                    )
+                )
             )
         )
+        .returning(ProjectMemberModel.role_id)
+        .execution_options(synchronize_session=False)
     )
     row = result.one_or_none()
     
     if not row:
-        raise HTTPException(404, "You are not a member of this project")
-    
-    member, role, project = row
-    
-    # Can't leave if you're the admin/creator
-    if member.member_role == MemberRoleEnum.ADMIN or project.creator_id == current_user.id:
-        raise HTTPException(400, "Admins and creators cannot leave the project. Transfer ownership or delete the project instead.")
-    
-    # Update role slots if they had a role
-    if role:
-        role.slots_filled = max(0, role.slots_filled - 1)
-        role.is_filled = role.slots_filled >= role.slots_available
-        
-        # Update project fully_staffed status
+        # Nothing deleted - either not a member or the admin/creator
         result = await db.execute(
-            select(func.count(ProjectRoleModel.id))
-            .where(
+            select(exists().where(
                 and_(
-                    ProjectRoleModel.project_id == project_id,
-                    ProjectRoleModel.is_filled == False
+                    ProjectMemberModel.project_id == project_id,
+                    ProjectMemberModel.user_id == current_user.id
                 )
-            )
+            ))
         )
-        unfilled_count = result.scalar()
-        
-        if unfilled_count > 0:
-            project.is_fully_staffed = False
+        if not result.scalar():
+            raise HTTPException(404, "You are not a member of this project")
+        raise HTTPException(400, "Admins and creators cannot leave the project. Transfer ownership or delete the project instead.")
+    
+    # Update role slots if they had a role
+    if row.role_id:
+        await _release_role_slot(db, project_id, row.role_id)
     
-    # Delete member
-    await db.delete(member)
     await db.commit()
     
     return {
@@ -344,70 +375,61 @@ async def get_project_stats(
 ):
     """Get project statistics. Must be a member."""
     
-    # Check if user is member
-    result = await db.execute(
-        select(ProjectMemberModel).where(
-            and_(
-                ProjectMemberModel.project_id == project_id,
-                ProjectMemberModel.user_id == current_user.id
-            )
-        )
-    )
-    if not result.scalar_one_or_none():
-        raise HTTPException(403, "Not a member of this project")
-    
-    # Get stats in optimized queries
-    # Total members
-    result = await db.execute(
-        select(func.count(ProjectMemberModel.id))
-        .where(ProjectMemberModel.project_id == project_id)
-    )
-    total_members = result.scalar()
-    
-    # Role stats
-    result = await db.execute(
+    # OPTIMIZATION: Membership check and all counts in one round trip - scalar subqueries
+    # plus a one-row aggregate over the project's roles
+    role_totals = (
         select(
             func.count(ProjectRoleModel.id).label('total_roles'),
             func.sum(ProjectRoleModel.slots_available).label('total_slots'),
             func.sum(ProjectRoleModel.slots_filled).label('filled_slots')
         )
         .where(ProjectRoleModel.project_id == project_id)
+        .subquery()
     )
-    role_stats = result.one()
-    
-    # Message count
-    from database.schemas import MessageModel
     result = await db.execute(
-        select(func.count(MessageModel.id))
-        .where(
-            and_(
-                MessageModel.project_id == project_id,
-                MessageModel.is_deleted == False
+        select(
+            exists().where(
+                and_(
+                    ProjectMemberModel.project_id == project_id,
+                    ProjectMemberModel.user_id == current_user.id
+                )
+            ).label('is_member'),
+            select(func.count(ProjectMemberModel.id))
+            .where(ProjectMemberModel.project_id == project_id)
+            .scalar_subquery().label('total_members'),
+            select(func.count(MessageModel.id))
+            .where(
+                and_(
+                    MessageModel.project_id == project_id,
+                    MessageModel.is_deleted == False
+                )
             )
-        )
-    )
-    message_count = result.scalar()
-    
-    # Pending applications
-    from database.schemas import ApplicationModel, ApplicationStatusEnum
-    result = await db.execute(
-        select(func.count(ApplicationModel.id))
-        .where(
-            and_(
-                ApplicationModel.project_id == project_id,
-                ApplicationModel.status == ApplicationStatusEnum.PENDING
+            .scalar_subquery().label('message_count'),
+            select(func.count(ApplicationModel.id))
+            .where(
+                and_(
+                    ApplicationModel.project_id == project_id,
+                    ApplicationModel.status == ApplicationStatusEnum.PENDING
+                )
             )
+            .scalar_subquery().label('pending_applications'),
+            role_totals.c.total_roles,
+            role_totals.c.total_slots,
+            role_totals.c.filled_slots
         )
     )
-    pending_applications = result.scalar()
+    stats = result.one()
+    
+    if not stats.is_member:
+        raise HTTPException(403, "Not a member of this project")
     
     return {
         "project_id": str(project_id),
-        "total_members": total_members,
-        "total_roles": role_stats.total_roles or 0,
-        "total_slots": int(role_stats.total_slots or 0),
-        "filled_slots": int(role_stats.filled_slots or 0),
-        "completion_percentage": round((role_stats.filled_slots / role_stats.total_slots * 100) if role_stats.total_slots else 0, 1),
-        "message_count": message_count,
-        "pending_applications": pending_applications
+        "total_members": stats.total_members,
+        "total_roles": stats.total_roles or 0,
+        "total_slots": int(stats.total_slots or 0),
+        "filled_slots": int(stats.filled_slots or 0),
+        "completion_percentage": round((stats.filled_slots / stats.total_slots * 100) if stats.total_slots else 0, 1),
+        "message_count": stats.message_count,
+        "pending_applications": stats.pending_applications
     }
\ No newline at end of file
@@ -1,13 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from sqlalchemy.orm import selectinload
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import selectinload, raiseload
 from database.initialization import get_db
 from database.schemas import UserProfileModel, SkillModel, user_skills
 from utils.auth import get_current_user
+from utils.cache import profile_name_cache
 from pydantic import BaseModel
 from database.schemas import GenderEnum
-from pydantic import BaseModel, Field, model_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
 
 router = APIRouter(prefix="/profile", tags=["Profile"])
 
@@ -29,6 +32,12 @@ class CreateProfileRequest(BaseModel):
     portfolio_url: str | None = None
     skill_ids: list[int] = []
     
+    @field_validator('skill_ids')
+    @classmethod
+    def dedupe_skill_ids(cls, skill_ids: list[int]) -> list[int]:
+        # Repeats would break the single bulk user_skills INSERT on its primary key
+        return list(dict.fromkeys(skill_ids))
+    
     @model_validator(mode='after')
     def check_actor_requirements(self):
         if self.is_actor:
@@ -64,7 +73,40 @@ class ProfileResponse(BaseModel):
     class Config:
         from_attributes = True
 
-@router.post("/create", status_code=status.HTTP_201_CREATED, response_model=ProfileResponse)
+def _profile_to_response(
+    profile: UserProfileModel, skills: list[dict], status_code: int = status.HTTP_200_OK
+) -> ORJSONResponse:
+    """Build the response from a loaded profile row"""
+    # OPTIMIZATION: Trusted DB values go straight to orjson - no ProfileResponse to build
+    # and no response_model validation/serialization pass
+    return ORJSONResponse({
+        "id": str(profile.id),
+        "user_id": str(profile.user_id),
+        "name": profile.name,
+        "age": profile.age,
+        "gender": profile.gender.value if profile.gender else None,
+        "profession": profile.profession,
+        "bio": profile.bio,
+        "is_actor": profile.is_actor,
+        "profile_photo_url": profile.profile_photo_url,
+        "city": profile.city,
+        "state": profile.state,
+        "country": profile.country,
+        "latitude": profile.latitude,
+        "longitude": profile.longitude,
+        "years_of_experience": profile.years_of_experience,
+        "previous_projects": profile.previous_projects,
+        "portfolio_url": profile.portfolio_url,
+        "skills": skills,
+        "created_at": profile.created_at.isoformat()
+    }, status_code=status_code)
+
+@router.post(
+    "/create",
+    status_code=status.HTTP_201_CREATED,
+    response_class=ORJSONResponse,
+    responses={201: {"model": ProfileResponse}}
+)
 async def create_profile(
     request: CreateProfileRequest,
     current_user = Depends(get_current_user),
@@ -78,12 +120,15 @@ async def create_profile(
         raise HTTPException(400, "Profile already exists")
     
     # Validate skills exist (single query instead of one per skill)
+    # OPTIMIZATION: The same rows build the response, so no skills query after the write
+    skills = []
     if request.skill_ids:
         result = await db.execute(
-            select(SkillModel.id).where(SkillModel.id.in_(request.skill_ids))
+            select(SkillModel.id, SkillModel.name, SkillModel.category)
+            .where(SkillModel.id.in_(request.skill_ids))
         )
-        valid_skill_ids = {skill_id for skill_id in result.scalars().all()}
-        invalid_skills = set(request.skill_ids) - valid_skill_ids
+        skills = [{"id": s.id, "name": s.name, "category": s.category} for s in result]
+        invalid_skills = set(request.skill_ids) - {s["id"] for s in skills}
         if invalid_skills:
             raise HTTPException(400, f"Invalid skill IDs: {invalid_skills}")
     
@@ -120,44 +165,20 @@ async def create_profile(
     await db.commit()
     await db.refresh(profile)
     
-    # Get skills with all data in one query (already fetched above, reuse)
-    if request.skill_ids:
-        result = await db.execute(
-            select(SkillModel).where(SkillModel.id.in_(request.skill_ids))
-        )
-        skills = [{"id": s.id, "name": s.name, "category": s.category} for s in result.scalars().all()]
-    else:
-        skills = []
-    
-    return ProfileResponse(
-        id=str(profile.id),
-        user_id=str(profile.user_id),
-        name=profile.name,
-        age=profile.age,
-        gender=profile.gender.value if profile.gender else None,
-        profession=profile.profession,
-        bio=profile.bio,
-        is_actor=profile.is_actor,
-        profile_photo_url=profile.profile_photo_url,
-        city=profile.city,
-        state=profile.state,
-        country=profile.country,
-        latitude=profile.latitude,
-        longitude=profile.longitude,
-        years_of_experience=profile.years_of_experience,
-        previous_projects=profile.previous_projects,
-        portfolio_url=profile.portfolio_url,
-        skills=skills,
-        created_at=profile.created_at.isoformat()
-    )
-@router.get("/me", response_model=ProfileResponse)
+    return _profile_to_response(profile, skills, status.HTTP_201_CREATED)
+@router.get(
+    "/me",
+    response_class=ORJSONResponse,
+    responses={200: {"model": ProfileResponse}}
+)
 async def get_my_profile(
     current_user = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     result = await db.execute(
         select(UserProfileModel)
-        .options(selectinload(UserProfileModel.skills))
+        # Any other relationship access raises instead of lazy-loading behind our back
+        .options(selectinload(UserProfileModel.skills), raiseload("*"))
         .where(UserProfileModel.user_id == current_user.id)
     )
     profile = result.scalar_one_or_none()
@@ -168,28 +189,12 @@ async def get_my_profile(
     # Use the relationship - no extra query needed
     skills = [{"id": s.id, "name": s.name, "category": s.category} for s in profile.skills]
     
-    return ProfileResponse(
-        id=str(profile.id),
-        user_id=str(profile.user_id),
-        name=profile.name,
-        age=profile.age,
-        gender=profile.gender.value if profile.gender else None,
-        profession=profile.profession,
-        bio=profile.bio,
-        is_actor=profile.is_actor,
-        profile_photo_url=profile.profile_photo_url,
-        city=profile.city,
-        state=profile.state,
-        country=profile.country,
-        latitude=profile.latitude,
-        longitude=profile.longitude,
-        years_of_experience=profile.years_of_experience,
-        previous_projects=profile.previous_projects,
-        portfolio_url=profile.portfolio_url,
-        skills=skills,
-        created_at=profile.created_at.isoformat()
-    )
-@router.put("/update", response_model=ProfileResponse)
+    return _profile_to_response(profile, skills)
+@router.put(
+    "/update",
+    response_class=ORJSONResponse,
+    responses={200: {"model": ProfileResponse}}
+)
 async def update_profile(
     request: CreateProfileRequest,
     current_user = Depends(get_current_user),
@@ -204,12 +209,15 @@ async def update_profile(
         raise HTTPException(404, "Profile not found")
     
     # Validate skills exist (if provided)
+    # OPTIMIZATION: The same rows build the response, so no skills query after the write
+    skills = []
     if request.skill_ids:
         result = await db.execute(
-            select(SkillModel.id).where(SkillModel.id.in_(request.skill_ids))
+            select(SkillModel.id, SkillModel.name, SkillModel.category)
+            .where(SkillModel.id.in_(request.skill_ids))
         )
-        valid_skill_ids = {skill_id for skill_id in result.scalars().all()}
-        invalid_skills = set(request.skill_ids) - valid_skill_ids
+        skills = [{"id": s.id, "name": s.name, "category": s.category} for s in result]
+        invalid_skills = set(request.skill_ids) - {s["id"] for s in skills}
         if invalid_skills:
             raise HTTPException(400, f"Invalid skill IDs: {invalid_skills}")
     
@@ -230,48 +238,22 @@ async def update_profile(
     profile.previous_projects = request.previous_projects
     profile.portfolio_url = request.portfolio_url
     
-    # Update skills - FIXED: use user_profile_id and profile.id
+    # OPTIMIZATION: Only the difference is written - dropped skills are deleted and new ones
+    # inserted, while unchanged rows are left alone instead of being deleted and re-inserted
     await db.execute(
-        user_skills.delete().where(user_skills.c.user_profile_id == profile.id)
+        user_skills.delete().where(
+            user_skills.c.user_profile_id == profile.id,
+            user_skills.c.skill_id.not_in(request.skill_ids)
+        )
     )
-    
-    # Bulk insert skills
     if request.skill_ids:
         await db.execute(
-            user_skills.insert(),
+            pg_insert(user_skills).on_conflict_do_nothing(),
             [{"user_profile_id": profile.id, "skill_id": skill_id} for skill_id in request.skill_ids]
         )
     
     await db.commit()
+    profile_name_cache.invalidate(current_user.id)
     await db.refresh(profile)
     
-    # Get skills - optimized fetch
-    if request.skill_ids:
-        result = await db.execute(
-            select(SkillModel).where(SkillModel.id.in_(request.skill_ids))
-        )
-        skills = [{"id": s.id, "name": s.name, "category": s.category} for s in result.scalars().all()]
-    else:
-        skills = []
-    
-    return ProfileResponse(
-        id=str(profile.id),
-        user_id=str(profile.user_id),
-        name=profile.name,
-        age=profile.age,
-        gender=profile.gender.value if profile.gender else None,
-        profession=profile.profession,
-        bio=profile.bio,
-        is_actor=profile.is_actor,
-        profile_photo_url=profile.profile_photo_url,
-        city=profile.city,
-        state=profile.state,
-        country=profile.country,
-        latitude=profile.latitude,
-        longitude=profile.longitude,
-        years_of_experience=profile.years_of_experience,
-        previous_projects=profile.previous_projects,
-        portfolio_url=profile.portfolio_url,
-        skills=skills,
-        created_at=profile.created_at.isoformat()
-    )
+    return _profile_to_response(profile, skills)
@@ -1,11 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, Query
+from fastapi.responses import ORJSONResponse, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_
-from database.initialization import get_db, AsyncSessionLocal
+from sqlalchemy import select, exists, and_, func, text, bindparam, any_
+from sqlalchemy.dialects.postgresql import JSONB, ARRAY, UUID as PG_UUID
+from database.initialization import get_db
 from database.schemas import MessageModel, ProjectMemberModel, UserProfileModel
-from utils.auth import get_current_user
+from utils.auth import get_current_user, decode_access_token
+from utils.websocket import (
+    ConnectionWriter, encode, frame, PONG_FRAME, TOKEN_REQUIRED_FRAME, INVALID_TOKEN_FRAME
+)
+from utils.batch_writer import message_writer
+from utils.cache import get_chat_member_name, history_page_cache
 from pydantic import BaseModel
-from uuid import UUID
+from uuid import UUID, uuid4
+from datetime import datetime, timezone
+from functools import partial
 import asyncio
 import logging
 
@@ -16,46 +25,68 @@ router = APIRouter(prefix="/projects", tags=["Project Chat"])
 # Store active connections per project
 class ProjectConnectionManager:
     def __init__(self):
-        self.active_connections: dict[str, list[tuple[WebSocket, UUID]]] = {}  # Store (websocket, user_id)
+        # OPTIMIZATION: Keyed by websocket so disconnects are O(1) instead of rebuilding the list
+        self.active_connections: dict[str, dict[WebSocket, tuple[UUID, ConnectionWriter]]] = {}  # websocket -> (user_id, writer)
     
     async def connect(self, project_id: str, websocket: WebSocket, user_id: UUID):
-        if project_id not in self.active_connections:
-            self.active_connections[project_id] = []
-        self.active_connections[project_id].append((websocket, user_id))
+        self.active_connections.setdefault(project_id, {})[websocket] = (user_id, ConnectionWriter(websocket))
         logger.info(f"User {user_id} connected to project {project_id}")
     
     def disconnect(self, project_id: str, websocket: WebSocket):
-        if project_id in self.active_connections:
-            self.active_connections[project_id] = [
-                (ws, uid) for ws, uid in self.active_connections[project_id] if ws != websocket
-            ]
-            if not self.active_connections[project_id]:
-                del self.active_connections[project_id]
-            logger.info(f"User disconnected from project {project_id}")
+        connections = self.active_connections.get(project_id)
+        if connections is None:
+            return
+        entry = connections.pop(websocket, None)
+        if entry is not None:
+            entry[1].close()
+        if not connections:
+            del self.active_connections[project_id]
+        logger.info(f"User disconnected from project {project_id}")
     
     async def broadcast(self, project_id: str, message: dict):
         """Broadcast message to all connected clients in a project"""
-        if project_id in self.active_connections:
-            disconnected = []
-            for websocket, user_id in self.active_connections[project_id]:
-                try:
-                    await websocket.send_json(message)
-                except Exception as e:
-                    logger.error(f"Error broadcasting to user {user_id}: {e}")
-                    disconnected.append(websocket)
-            
-            # Clean up disconnected websockets
-            for ws in disconnected:
+        # tuple() because a full writer queue calls disconnect(), which edits this dict mid-loop
+        connections = tuple(self.active_connections.get(project_id, {}).items())
+        if not connections:
+            return
+        
+        # OPTIMIZATION: Encode once and hand the frame to each connection's writer task -
+        # broadcasting never waits on the network, and a client that can't keep up
+        # only fills its own queue before being dropped
+        payload = encode(message)
+        for ws, (_, writer) in connections:
+            if not writer.send(payload):
                 self.disconnect(project_id, ws)
     
     def get_connected_users(self, project_id: str) -> list[UUID]:
         """Get list of user IDs connected to a project"""
         if project_id in self.active_connections:
-            return [user_id for _, user_id in self.active_connections[project_id]]
+            return [user_id for user_id, _ in self.active_connections[project_id].values()]
         return []
 
 manager = ProjectConnectionManager()
 
+# Error replies for the project chat socket
+_NOT_MEMBER_FRAME = frame({"error": "Not a member of this project"})
+_TOO_LONG_FRAME = frame({"error": "Message too long (max 5000 characters)"})
+_TIMEOUT_FRAME = frame({"error": "Connection timeout"})
+_INTERNAL_ERROR_FRAME = frame({"error": "Internal error"})
+
+_retractions: set[asyncio.Task] = set()
+
+def _on_message_saved(project_id: str, message_id: UUID, future: asyncio.Future):
+    """Retract an already-broadcast message if its insert failed"""
+    if future.cancelled() or future.exception() is None:
+        return
+    task = asyncio.create_task(manager.broadcast(project_id, {
+        "type": "message_deleted",
+        "message_id": str(message_id),
+        "project_id": project_id
+    }))
+    # The event loop only keeps a weak reference to tasks
+    _retractions.add(task)
+    task.add_done_callback(_retractions.discard)
+
 class MessageResponse(BaseModel):
     id: str
     project_id: str
@@ -77,6 +108,7 @@ async def project_chat_websocket(
     connected = False
     user_id = None
     sender_name = "Unknown"
+    project_id_str = str(project_id)  # Room key, formatted once per connection
     
     try:
         # Wait for auth message with timeout
@@ -87,199 +119,295 @@ async def project_chat_websocket(
         token = auth_data.get("token")
         
         if not token:
-            await websocket.send_json({"error": "Token required"})
+            await websocket.send(TOKEN_REQUIRED_FRAME)
             await websocket.close()
             return
         
         # Verify token and get user
-        from jose import jwt, JWTError
-        from config import SECRET_KEY, ALGORITHM
+        from jwt import InvalidTokenError as JWTError
         
         try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            user_id = UUID(payload["sub"])
+            user_id = decode_access_token(token)
         except (JWTError, ValueError, KeyError) as e:
             logger.warning(f"Invalid token in WebSocket: {e}")
-            await websocket.send_json({"error": "Invalid token"})
+            await websocket.send(INVALID_TOKEN_FRAME)
             await websocket.close()
             return
         
-        # OPTIMIZATION: Check membership and get profile in one query with JOIN
-        async with AsyncSessionLocal() as db:
-            result = await db.execute(
-                select(ProjectMemberModel, UserProfileModel)
-                .outerjoin(UserProfileModel, ProjectMemberModel.user_id == UserProfileModel.user_id)
-                .where(
-                    and_(
-                        ProjectMemberModel.project_id == project_id,
-                        ProjectMemberModel.user_id == user_id
-                    )
-                )
-            )
-            row = result.one_or_none()
-            
-            if not row:
-                await websocket.send_json({"error": "Not a member of this project"})
-                await websocket.close()
-                return
-            
-            member, profile = row
-            sender_name = profile.name if profile else "Unknown"
+        # OPTIMIZATION: Membership is checked in the DB every time, but a cached name
+        # reduces it to a bare EXISTS
+        member_name = await get_chat_member_name(project_id, user_id)
+        if member_name is None:
+            await websocket.send(_NOT_MEMBER_FRAME)
+            await websocket.close()
+            return
+        sender_name = member_name
+        user_id_str = str(user_id)
         
         # Add to connections
-        await manager.connect(str(project_id), websocket, user_id)
+        await manager.connect(project_id_str, websocket, user_id)
         connected = True
         
         # Send connection success with online users
-        online_users = manager.get_connected_users(str(project_id))
-        await websocket.send_json({
+        online_users = manager.get_connected_users(project_id_str)
+        await websocket.send_text(encode({
             "type": "connected",
-            "project_id": str(project_id),
-            "online_users": [str(uid) for uid in online_users]
-        })
+            "project_id": project_id_str,
+            "online_users": online_users
+        }))
         
         # Broadcast user joined
-        await manager.broadcast(str(project_id), {
+        await manager.broadcast(project_id_str, {
             "type": "user_joined",
-            "user_id": str(user_id),
+            "user_id": user_id_str,
             "user_name": sender_name,
-            "online_users": [str(uid) for uid in online_users]
+            "online_users": online_users  # UUIDs are encoded by orjson in the broadcast
         })
         
-        # Handle messages with heartbeat
-        while True:
-            try:
-                data = await asyncio.wait_for(
-                    websocket.receive_json(),
-                    timeout=60.0  # 60s timeout
-                )
-                
-                # Handle ping/pong
-                if data.get("type") == "ping":
-                    await websocket.send_json({"type": "pong"})
-                    continue
-                
-                message_content = data.get("content")
-                
-                if not message_content:
-                    continue
-                
-                # Validate message length
-                if len(message_content) > 5000:
-                    await websocket.send_json({"error": "Message too long (max 5000 characters)"})
-                    continue
-                
-                # Save message to DB
-                async with AsyncSessionLocal() as db:
-                    message = MessageModel(
-                        project_id=project_id,
-                        sender_id=user_id,
-                        content=message_content.strip()
-                    )
-                    db.add(message)
-                    await db.commit()
-                    await db.refresh(message)
-                    
-                    # Broadcast to all connected clients
-                    await manager.broadcast(str(project_id), {
-                        "type": "message",
-                        "id": str(message.id),
-                        "project_id": str(message.project_id),
-                        "sender_id": str(message.sender_id),
-                        "sender_name": sender_name,
-                        "content": message.content,
-                        "sent_at": message.sent_at.isoformat(),
-                        "edited_at": None,
-                        "is_deleted": False
-                    })
+        # Handle messages. Dead connections are detected by the server's protocol-level
+        # pings (ws_ping_interval/ws_ping_timeout), so there's no per-receive timer
+        async for data in websocket.iter_json():
+            # Handle ping/pong
+            if data.get("type") == "ping":
+                await websocket.send(PONG_FRAME)
+                continue
+            
+            message_content = data.get("content")
+            
+            if not message_content:
+                continue
+            
+            # Validate message length
+            if len(message_content) > 5000:
+                await websocket.send(_TOO_LONG_FRAME)
+                continue
+            
+            # OPTIMIZATION: Hand the row to the batch writer and broadcast right away -
+            # id and sent_at are set here so nothing has to come back from the insert
+            message = MessageModel(
+                id=uuid4(),
+                project_id=project_id,
+                sender_id=user_id,
+                sender_name=sender_name,
+                content=message_content.strip(),
+                sent_at=datetime.now(timezone.utc)
+            )
+            message_writer.submit(message).add_done_callback(
+                partial(_on_message_saved, project_id_str, message.id)
+            )
             
-            except asyncio.TimeoutError:
-                # Send heartbeat check
-                await websocket.send_json({"type": "ping"})
+            # Broadcast to all connected clients
+            # UUIDs and the timestamp are left to orjson in the broadcast
+            await manager.broadcast(project_id_str, {
+                "type": "message",
+                "id": message.id,
+                "project_id": message.project_id,
+                "sender_id": message.sender_id,
+                "sender_name": sender_name,
+                "content": message.content,
+                "sent_at": message.sent_at,
+                "edited_at": None,
+                "is_deleted": False
+            })
+        
+        # iter_json ends quietly when the client disconnects
+        logger.info(f"WebSocket disconnected for user {user_id}")
     
     except asyncio.TimeoutError:
         logger.warning(f"WebSocket timeout for user {user_id}")
-        await websocket.send_json({"error": "Connection timeout"})
+        await websocket.send(_TIMEOUT_FRAME)
         await websocket.close()
     except WebSocketDisconnect:
         logger.info(f"WebSocket disconnected for user {user_id}")
     except Exception as e:
         logger.error(f"WebSocket error for user {user_id}: {e}", exc_info=True)
         try:
-            await websocket.send_json({"error": "Internal error"})
+            await websocket.send(_INTERNAL_ERROR_FRAME)
         except:
             pass
     finally:
         if connected:
-            manager.disconnect(str(project_id), websocket)
+            manager.disconnect(project_id_str, websocket)
             # Broadcast user left
-            online_users = manager.get_connected_users(str(project_id))
-            await manager.broadcast(str(project_id), {
+            online_users = manager.get_connected_users(project_id_str)
+            await manager.broadcast(project_id_str, {
                 "type": "user_left",
-                "user_id": str(user_id),
+                "user_id": user_id_str,
                 "user_name": sender_name,
-                "online_users": [str(uid) for uid in online_users]
+                "online_users": online_users
             })
 
 
-@router.get("/{project_id}/chat/messages", response_model=list[MessageResponse])
+def _cursor_lookup():
+    """sent_at of the cursor message as a scalar subquery; NULL for an unknown id"""
+    # OPTIMIZATION: Resolved inside the page query instead of a separate round trip
+    return (
+        select(MessageModel.sent_at)
+        .where(MessageModel.id == bindparam("cursor_id"))
+        .correlate(None)  # Standalone lookup, not tied to the outer messages row
+        .scalar_subquery()
+    )
+
+def _cursor_sent_at(missing: str):
+    """Cursor sent_at, or the given bound when the id is unknown"""
+    return func.coalesce(_cursor_lookup(), text(f"'{missing}'::timestamptz"))
+
+# OPTIMIZATION: Built once at import with bind parameters, so every request reuses the
+# compiled SQL from SQLAlchemy's statement cache instead of rebuilding the expression
+_IS_MEMBER = exists().where(
+    and_(
+        ProjectMemberModel.project_id == bindparam("project_id"),
+        ProjectMemberModel.user_id == bindparam("user_id")
+    )
+)
+_MEMBER_CHECK_STMT = select(_IS_MEMBER)
+
+# Plain columns from messages - the sender name is stored on the row, so no profile
+# join and no ORM objects to build. Gated on membership so authorizing and
+# fetching share one round trip
+_HISTORY_STMT = (
+    select(
+        MessageModel.id,
+        MessageModel.project_id,
+        MessageModel.sender_id,
+        MessageModel.content,
+        MessageModel.sent_at,
+        MessageModel.edited_at,
+        MessageModel.is_deleted,
+        # Rows saved before sender_name existed (and not backfilled) fall back to the
+        # profile; COALESCE only runs the lookup for those rows
+        func.coalesce(
+            MessageModel.sender_name,
+            select(UserProfileModel.name)
+            .where(UserProfileModel.user_id == MessageModel.sender_id)
+            .scalar_subquery()
+        ).label("sender_name")
+    )
+    .where(MessageModel.project_id == bindparam("project_id"), _IS_MEMBER)
+)
+
+def _newest_first_page(stmt):
+    """Take the newest rows, then flip them back to chronological order in SQL"""
+    page = stmt.order_by(MessageModel.sent_at.desc()).limit(bindparam("limit")).subquery()
+    return select(page).order_by(page.c.sent_at.asc())
+
+# Cursor pages also say whether their cursor resolved, so an unknown id can be told apart
+_CURSOR_HISTORY_STMT = _HISTORY_STMT.add_columns(_cursor_lookup().is_not(None).label("cursor_found"))
+
+_LATEST_PAGE_STMT = _newest_first_page(_HISTORY_STMT)
+_BEFORE_PAGE_STMT = _newest_first_page(
+    _CURSOR_HISTORY_STMT.where(MessageModel.sent_at < _cursor_sent_at("infinity"))
+)
+# Already chronological - no flip needed
+_AFTER_PAGE_STMT = (
+    _CURSOR_HISTORY_STMT
+    .where(MessageModel.sent_at > _cursor_sent_at("-infinity"))
+    .order_by(MessageModel.sent_at.asc())
+    .limit(bindparam("limit"))
+)
+
+# OPTIMIZATION: Postgres builds the whole JSON array, so one value comes back instead of a row
+# per user. Membership-gated like the history pages
+_ONLINE_PROFILES_STMT = select(
+    func.jsonb_agg(
+        func.jsonb_build_object(
+            "user_id", UserProfileModel.user_id,
+            "name", UserProfileModel.name,
+            "profile_photo_url", UserProfileModel.profile_photo_url
+        ),
+        type_=JSONB
+    )
+).where(UserProfileModel.user_id.in_(bindparam("user_ids", expanding=True)), _IS_MEMBER)
+
+# Revalidates a cached page in one round trip: still a member, and none of the page's
+# messages soft-deleted since it was cached (possibly by another worker)
+_CACHED_PAGE_CHECK_STMT = select(
+    _IS_MEMBER,
+    exists().where(
+        MessageModel.id == any_(bindparam("live_ids", type_=ARRAY(PG_UUID(as_uuid=True)))),
+        MessageModel.is_deleted
+    )
+)
+
+@router.get(
+    "/{project_id}/chat/messages",
+    response_class=ORJSONResponse,
+    responses={200: {"model": list[MessageResponse]}}
+)
 async def get_project_messages(
     project_id: UUID,
     limit: int = Query(default=50, ge=1, le=200),
-    before_id: UUID | None = None,  # For pagination
+    before_id: UUID | None = None,  # For pagination (older messages)
+    after_id: UUID | None = None,  # For catching up (newer messages)
     current_user = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     """Get message history for a project. Must be a member. Supports pagination."""
     
-    # Check if user is member
-    result = await db.execute(
-        select(ProjectMemberModel).where(
-            and_(
-                ProjectMemberModel.project_id == project_id,
-                ProjectMemberModel.user_id == current_user.id
-            )
-        )
-    )
-    if not result.scalar_one_or_none():
-        raise HTTPException(403, "Not a member of this project")
-    
-    # OPTIMIZATION: Get messages with sender profiles in one query
-    stmt = (
-        select(MessageModel, UserProfileModel)
-        .outerjoin(UserProfileModel, MessageModel.sender_id == UserProfileModel.user_id)
-        .where(MessageModel.project_id == project_id)
-    )
+    # OPTIMIZATION: Back-scroll pages are served from memory after a primary-key check
+    # instead of re-reading and re-encoding up to 200 rows
+    cache_key = (project_id, before_id, limit) if before_id and not after_id else None
+    if cache_key is not None:
+        cached = history_page_cache.get(cache_key)
+        if cached is not None:
+            body, live_ids = cached
+            result = await db.execute(_CACHED_PAGE_CHECK_STMT, {
+                "project_id": project_id, "user_id": current_user.id, "live_ids": live_ids
+            })
+            is_member, has_deleted = result.one()
+            if not is_member:
+                raise HTTPException(403, "Not a member of this project")
+            if not has_deleted:
+                return Response(body, media_type="application/json")
+            history_page_cache.invalidate(cache_key)
     
-    # Pagination support
-    if before_id:
+    params = {"project_id": project_id, "user_id": current_user.id, "limit": limit}
+    if after_id:
+        # Messages after a specific message (for catching up)
+        stmt = _AFTER_PAGE_STMT
+        params["cursor_id"] = after_id
+    elif before_id:
         # Get messages before a specific message (for loading older messages)
-        result_before = await db.execute(
-            select(MessageModel.sent_at).where(MessageModel.id == before_id)
-        )
-        before_timestamp = result_before.scalar_one_or_none()
-        if before_timestamp:
-            stmt = stmt.where(MessageModel.sent_at < before_timestamp)
+        stmt = _BEFORE_PAGE_STMT
+        params["cursor_id"] = before_id
+    else:
+        stmt = _LATEST_PAGE_STMT
     
-    stmt = stmt.order_by(MessageModel.sent_at.desc()).limit(limit)
+    rows = (await db.execute(stmt, params)).all()
     
-    result = await db.execute(stmt)
-    rows = result.all()
+    # An unknown after_id (e.g. broadcast but still queued in the batch writer, or retracted)
+    # would otherwise return the project's oldest messages - catch up from the latest page
+    if after_id and rows and not rows[0].cursor_found:
+        del params["cursor_id"]
+        rows = (await db.execute(_LATEST_PAGE_STMT, params)).all()
     
-    # Build response (reverse to get chronological order)
-    response = []
-    for msg, profile in reversed(rows):
-        response.append(MessageResponse(
-            id=str(msg.id),
-            project_id=str(msg.project_id),
-            sender_id=str(msg.sender_id) if msg.sender_id else "deleted",
-            sender_name=profile.name if profile else "Unknown User",
-            content=msg.content if not msg.is_deleted else "[Message deleted]",
-            sent_at=msg.sent_at.isoformat(),
-            edited_at=msg.edited_at.isoformat() if msg.edited_at else None,
-            is_deleted=msg.is_deleted
-        ))
+    # An empty page is either the end of history or no access - only then ask which
+    if not rows:
+        result = await db.execute(
+            _MEMBER_CHECK_STMT, {"project_id": project_id, "user_id": current_user.id}
+        )
+        if not result.scalar():
+            raise HTTPException(403, "Not a member of this project")
     
+    # OPTIMIZATION: Page rows become dicts directly, and the encoded body is what the
+    # back-scroll cache stores - there is no MessageResponse per message
+    response = ORJSONResponse([
+        {
+            "id": row.id,
+            "project_id": row.project_id,
+            "sender_id": row.sender_id if row.sender_id else "deleted",
+            "sender_name": row.sender_name or "Unknown User",
+            "content": row.content if not row.is_deleted else "[Message deleted]",
+            "sent_at": row.sent_at,
+            "edited_at": row.edited_at,
+            "is_deleted": row.is_deleted
+        }
+        for row in rows
+    ])
+    # An unknown before_id yields the latest page, which must not be cached as a back-scroll page
+    if cache_key is not None and rows and rows[0].cursor_found:
+        live_ids = [row.id for row in rows if not row.is_deleted]
+        history_page_cache.set(cache_key, (response.body, live_ids))
     return response
 
 
@@ -313,6 +441,7 @@ async def delete_project_message(
     
     message.is_deleted = True
     await db.commit()
+    history_page_cache.invalidate_where(lambda key: key[0] == project_id)
     
     # Broadcast deletion to connected clients
     await manager.broadcast(str(message.project_id), {
@@ -332,36 +461,19 @@ async def get_project_online_users(
 ):
     """Get list of users currently online in a project."""
     
-    # Check if user is member
-    result = await db.execute(
-        select(ProjectMemberModel).where(
-            and_(
-                ProjectMemberModel.project_id == project_id,
-                ProjectMemberModel.user_id == current_user.id
-            )
-        )
-    )
-    if not result.scalar_one_or_none():
-        raise HTTPException(403, "Not a member of this project")
-    
+    params = {"project_id": project_id, "user_id": current_user.id}
     online_user_ids = manager.get_connected_users(str(project_id))
     
-    if not online_user_ids:
-        return {"online_users": []}
+    online_users = None
+    if online_user_ids:
+        # Get user profiles
+        result = await db.execute(_ONLINE_PROFILES_STMT, {**params, "user_ids": online_user_ids})
+        online_users = result.scalar()
     
-    # Get user profiles
-    result = await db.execute(
-        select(UserProfileModel).where(UserProfileModel.user_id.in_(online_user_ids))
-    )
-    profiles = result.scalars().all()
+    # Nobody online, or the gate filtered everything out - only then check membership
+    if online_users is None:
+        result = await db.execute(_MEMBER_CHECK_STMT, params)
+        if not result.scalar():
+            raise HTTPException(403, "Not a member of this project")
     
-    return {
-        "online_users": [
-            {
-                "user_id": str(p.user_id),
-                "name": p.name,
-                "profile_photo_url": p.profile_photo_url
-            }
-            for p in profiles
-        ]
-    }
\ No newline at end of file
+    return {"online_users": online_users or []}
@@ -1,6 +1,8 @@
 from fastapi import APIRouter, Depends, Query
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, and_, or_, func
+from sqlalchemy.orm import raiseload
 from database.initialization import get_db
 from database.schemas import (
     ProjectModel, ProjectRoleModel, UserProfileModel, SkillModel,
@@ -48,7 +50,11 @@ class PaginationParams(BaseModel):
     page: int = Field(default=1, ge=1)
     limit: int = Field(default=20, ge=1, le=100)
 
-@router.get("/projects", response_model=list[ProjectSearchResult])
+@router.get(
+    "/projects",
+    response_class=ORJSONResponse,
+    responses={200: {"model": list[ProjectSearchResult]}}
+)
 async def search_projects(
     skill_id: int | None = Query(None),
     project_type: str | None = Query(None),
@@ -63,8 +69,9 @@ async def search_projects(
 ):
     """Search for projects. Filter by skill, type, location, and text query."""
     
-    # Base query - only show ACTIVE projects that aren't fully staffed
-    stmt = select(ProjectModel).where(
+    # Base query - only show ACTIVE projects that aren't fully staffed. Roles come from the
+    # batched query below; raiseload makes any per-row lazy load fail loudly instead
+    stmt = select(ProjectModel).options(raiseload("*")).where(
         and_(
             ProjectModel.status == ProjectStatusEnum.ACTIVE,
             ProjectModel.is_fully_staffed == False
@@ -90,7 +97,7 @@ async def search_projects(
             stmt = stmt.where(ProjectModel.project_type == ProjectTypeEnum(project_type))
         except ValueError:
             # Invalid project type, return empty
-            return []
+            return ORJSONResponse([])
     
     # If filtering by skill, join with roles
     if skill_id:
@@ -109,6 +116,7 @@ async def search_projects(
     if project_ids:
         roles_result = await db.execute(
             select(ProjectRoleModel)
+            .options(raiseload("*"))
             .where(
                 and_(
                     ProjectRoleModel.project_id.in_(project_ids),
@@ -150,28 +158,34 @@ async def search_projects(
             "payment_amount": r.payment_amount
         } for r in roles]
         
-        results.append(ProjectSearchResult(
-            id=str(project.id),
-            name=project.name,
-            description=project.description,
-            project_type=project.project_type.value,
-            city=project.city,
-            state=project.state,
-            country=project.country,
-            distance_km=round(distance, 2) if distance else None,
-            roles=roles_data
-        ))
+        # OPTIMIZATION: Built as a dict with its roles nested inline - the list is sorted and
+        # sliced as-is, and no ProjectSearchResult is validated per match
+        results.append({
+            "id": str(project.id),
+            "name": project.name,
+            "description": project.description,
+            "project_type": project.project_type.value,
+            "city": project.city,
+            "state": project.state,
+            "country": project.country,
+            "distance_km": round(distance, 2) if distance else None,
+            "roles": roles_data
+        })
     
     # Sort by distance if location provided
     if latitude and longitude:
-        results.sort(key=lambda x: x.distance_km if x.distance_km else float('inf'))
+        results.sort(key=lambda x: x["distance_km"] if x["distance_km"] else float('inf'))
     
     # Pagination
     offset = (page - 1) * limit
-    return results[offset:offset + limit]
+    return ORJSONResponse(results[offset:offset + limit])
 
 
-@router.get("/users", response_model=list[UserSearchResult])
+@router.get(
+    "/users",
+    response_class=ORJSONResponse,
+    responses={200: {"model": list[UserSearchResult]}}
+)
 async def search_users(
     name: str | None = Query(None),
     profession: str | None = Query(None),
@@ -187,7 +201,8 @@ async def search_users(
 ):
     """Search for users. Filter by name, profession, skill, and location."""
     
-    stmt = select(UserProfileModel)
+    # Skills come from the batched query below; raiseload makes any per-row lazy load fail loudly
+    stmt = select(UserProfileModel).options(raiseload("*"))
     
     # Filter by name (partial match)
     if name:
@@ -218,6 +233,7 @@ async def search_users(
         skills_result = await db.execute(
             select(SkillModel, user_skills.c.user_profile_id)
             .join(user_skills)
+            .options(raiseload("*"))
             .where(user_skills.c.user_profile_id.in_(profile_ids))
         )
         all_skills = skills_result.all()
@@ -245,23 +261,24 @@ async def search_users(
         
         skills_data = [{"id": s.id, "name": s.name, "category": s.category} for s in skills]
         
-        results.append(UserSearchResult(
-            id=str(profile.id),
-            user_id=str(profile.user_id),
-            name=profile.name,
-            profession=profile.profession,
-            city=profile.city,
-            state=profile.state,
-            country=profile.country,
-            distance_km=round(distance, 2) if distance else None,
-            profile_photo_url=profile.profile_photo_url,
-            skills=skills_data
-        ))
+        # Same approach as the project results above: one dict per match, no UserSearchResult
+        results.append({
+            "id": str(profile.id),
+            "user_id": str(profile.user_id),
+            "name": profile.name,
+            "profession": profile.profession,
+            "city": profile.city,
+            "state": profile.state,
+            "country": profile.country,
+            "distance_km": round(distance, 2) if distance else None,
+            "profile_photo_url": profile.profile_photo_url,
+            "skills": skills_data
+        })
     
     # Sort by distance if location provided
     if latitude and longitude:
-        results.sort(key=lambda x: x.distance_km if x.distance_km else float('inf'))
+        results.sort(key=lambda x: x["distance_km"] if x["distance_km"] else float('inf'))
     
     # Pagination
     offset = (page - 1) * limit
-    return results[offset:offset + limit]
\ No newline at end of file
+    return ORJSONResponse(results[offset:offset + limit])
\ No newline at end of file
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 from database.initialization import get_db
@@ -49,7 +50,11 @@ async def create_skill(
         created_at=skill.created_at.isoformat()
     )
 
-@router.get("/list", response_model=list[SkillResponse])
+@router.get(
+    "/list",
+    response_class=ORJSONResponse,
+    responses={200: {"model": list[SkillResponse]}}
+)
 async def list_skills(
     category: str | None = Query(None),
     search: str | None = Query(None, description="Search skills by name"),
@@ -68,15 +73,17 @@ async def list_skills(
     result = await db.execute(query.order_by(SkillModel.name))
     skills = result.scalars().all()
     
-    return [
-        SkillResponse(
-            id=skill.id,
-            name=skill.name,
-            category=skill.category,
-            created_at=skill.created_at.isoformat()
-        )
+    # OPTIMIZATION: The unpaginated catalogue is serialized from the rows directly rather
+    # than through a SkillResponse per skill
+    return ORJSONResponse([
+        {
+            "id": skill.id,
+            "name": skill.name,
+            "category": skill.category,
+            "created_at": skill.created_at.isoformat()
+        }
         for skill in skills
-    ]
+    ])
 
 @router.get("/categories", response_model=list[str])
 async def list_categories(db: AsyncSession = Depends(get_db)):
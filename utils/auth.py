@@ -2,11 +2,13 @@
 from datetime import datetime, timedelta, timezone
 import secrets
 import hashlib
+import time
 
 # Security / auth
 from argon2 import PasswordHasher
 from argon2.exceptions import VerifyMismatchError
-from jose import jwt, JWTError
+import jwt
+from jwt import InvalidTokenError as JWTError
 
 # FastAPI
 from fastapi import Depends, HTTPException, status
@@ -14,17 +16,37 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 # Database
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import insert
 from uuid import UUID
 
 # App config & models
 from config import ACCESS_TOKEN_EXPIRE_HOURS, SECRET_KEY, ALGORITHM, REFRESH_TOKEN_EXPIRE_DAYS
 from database.initialization import get_db
 from database.schemas import UserModel, RefreshTokenModel
+from utils.cache import TTLCache
 
-ph = PasswordHasher()
+# Argon2id at the OWASP baseline (t=2, m=19 MiB, p=1). Existing hashes keep verifying
+# because their parameters are encoded in the hash string
+ph = PasswordHasher(time_cost=2, memory_cost=19 * 1024, parallelism=1)
 security = HTTPBearer()
 
+# token_hash -> user_id for refresh tokens issued by this process. Only a hint that lets
+# /refresh validate-and-revoke in one statement; revocation is always checked in the DB
+refresh_token_cache = TTLCache(maxsize=10_000, ttl=REFRESH_TOKEN_EXPIRE_DAYS * 86400)
+
+# blake2b(access token) -> user_id, filled only after a successful decode. Entries live at
+# most a minute and never past the token's own exp. Keyed by digest so raw bearer tokens
+# aren't kept in memory
+access_token_cache = TTLCache(maxsize=50_000, ttl=60.0)
+
+# OPTIMIZATION: Decoder and algorithm list built once at import instead of per decode
+_jwt_decoder = jwt.PyJWT()
+_JWT_ALGORITHMS = [ALGORITHM]
+
+def normalize_email(email: str) -> str:
+    """Canonical stored form of an email: surrounding whitespace stripped, then lowercased"""
+    return email.strip().lower()
+
 def hash_refresh_token(token: str) -> str:
     """Hash a refresh token using SHA256"""
     return hashlib.sha256(token.encode("utf-8")).hexdigest()
@@ -33,6 +55,9 @@ def hash_password(password: str) -> str:
     """Hash a password using Argon2"""
     return ph.hash(password)
 
+# Verified against for unknown emails so login takes the same time either way
+DUMMY_PASSWORD_HASH = ph.hash(secrets.token_urlsafe(16))
+
 def verify_password(hashed_password: str, plain_password: str) -> bool:
     """Verify a password against its Argon2 hash"""
     try:
@@ -46,7 +71,7 @@ def verify_password(hashed_password: str, plain_password: str) -> bool:
         return False
 
 async def create_tokens(user_id: UUID, db: AsyncSession) -> dict:
-    """Create access and refresh tokens for a user"""
+    """Create access and refresh tokens for a user (caller commits the refresh token)"""
     # Create access token
     expire = datetime.now(tz=timezone.utc) + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
     to_encode = {"sub": str(user_id), "exp": expire}
@@ -57,14 +82,17 @@ async def create_tokens(user_id: UUID, db: AsyncSession) -> dict:
     token_hash = hash_refresh_token(refresh_token)
     
     # Save refresh token to DB
+    # OPTIMIZATION: Plain INSERT in the caller's transaction - the caller's single commit
+    # covers it together with whatever else the route changed
     refresh_expires = datetime.now(tz=timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
-    db_refresh_token = RefreshTokenModel(
-        user_id=user_id,
-        token_hash=token_hash,
-        expires_at=refresh_expires
+    await db.execute(
+        insert(RefreshTokenModel).values(
+            user_id=user_id,
+            token_hash=token_hash,
+            expires_at=refresh_expires
+        )
     )
-    db.add(db_refresh_token)
-    await db.commit()
+    refresh_token_cache.set(token_hash, user_id)
 
     return {
         "access_token": access_token,
@@ -72,6 +100,28 @@ async def create_tokens(user_id: UUID, db: AsyncSession) -> dict:
         "token_type": "bearer"
     }
 
+def decode_access_token(token: str) -> UUID:
+    """Return the user id of a valid access token; raises JWTError/ValueError otherwise"""
+    # OPTIMIZATION: Reconnects and bursts of API calls reuse the verified result instead
+    # of re-running the HMAC check and JSON parse
+    cache_key = hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+    user_id = access_token_cache.get(cache_key)
+    if user_id is not None:
+        return user_id
+    
+    payload = _jwt_decoder.decode(token, SECRET_KEY, algorithms=_JWT_ALGORITHMS)
+    user_id_str = payload.get("sub")
+    if user_id_str is None:
+        raise JWTError("Token has no subject")
+    user_id = UUID(user_id_str)
+    
+    ttl = access_token_cache.ttl
+    if "exp" in payload:
+        ttl = min(ttl, payload["exp"] - time.time())
+    if ttl > 0:
+        access_token_cache.set(cache_key, user_id, ttl=ttl)
+    return user_id
+
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: AsyncSession = Depends(get_db)
@@ -85,23 +135,15 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-    try: 
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id_str: str = payload.get("sub")
-        
-        if user_id_str is None:
-            raise credentials_exception
-        
-        user_id = UUID(user_id_str)
-
+    try:
+        user_id = decode_access_token(token)
     except JWTError:
         raise credentials_exception
     except ValueError:  # Invalid UUID
         raise credentials_exception
     
-    # Get user from database
-    result = await db.execute(select(UserModel).where(UserModel.id == user_id))
-    user = result.scalar_one_or_none()
+    # Get user from database (identity-map aware - later db.get() calls in the request are free)
+    user = await db.get(UserModel, user_id)
     
     if not user:
         raise credentials_exception
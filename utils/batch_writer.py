@@ -0,0 +1,103 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.initialization import AsyncSessionLocal
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH = 64  # Rows per INSERT transaction
+
+class BatchWriter:
+    """Queues ORM rows and inserts them in batched transactions from one background task"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.queue: asyncio.Queue | None = None
+        self.task: asyncio.Task | None = None
+        self.session: AsyncSession | None = None
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        # OPTIMIZATION: One session for the writer's lifetime; it only holds a pooled
+        # connection while a batch transaction is open
+        self.session = AsyncSessionLocal()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush whatever is queued, then stop the writer task"""
+        if self.task is None:
+            return
+        self.queue.put_nowait(None)
+        await self.task
+        self.task = None
+        await self.session.close()
+        self.session = None
+
+    def submit(self, row) -> asyncio.Future:
+        """Queue a row for insert; the future resolves once it is committed"""
+        future = asyncio.get_running_loop().create_future()
+        if self.task is None:
+            # Nothing would ever drain the queue, so fail now instead of leaving the caller waiting
+            logger.error(f"{self.name} insert rejected: writer is not running")
+            future.set_exception(RuntimeError(f"{self.name} writer is not running"))
+            return future
+        self.queue.put_nowait((row, future))
+        return future
+
+    async def _run(self):
+        while True:
+            item = await self.queue.get()
+            stopping = item is None
+            batch = [] if stopping else [item]
+            # OPTIMIZATION: No timer - whatever queued up while the last commit was in
+            # flight goes out together, so idle traffic pays no extra latency and busy
+            # rooms share one round trip per batch
+            while len(batch) < MAX_BATCH:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            if batch:
+                await self._flush(batch)
+            if stopping and self.queue.empty():
+                return
+
+    async def _flush(self, batch: list):
+        try:
+            await self._commit([row for row, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                logger.error(f"{self.name} insert failed: {e}")
+                _resolve(batch[0][1], e)
+                return
+            # One bad row (e.g. its project was just deleted) shouldn't lose the others
+            logger.warning(f"{self.name} batch insert failed, retrying rows one by one: {e}")
+            for entry in batch:
+                await self._flush([entry])
+            return
+
+        for _, future in batch:
+            _resolve(future)
+
+    async def _commit(self, rows: list):
+        try:
+            async with self.session.begin():
+                self.session.add_all(rows)
+        finally:
+            self.session.expunge_all()  # Committed rows aren't needed again
+
+def _resolve(future: asyncio.Future, error: Exception | None = None):
+    if future.done():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
+
+message_writer = BatchWriter("Project message")
+dm_writer = BatchWriter("Direct message")
@@ -0,0 +1,131 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+from uuid import UUID
+import asyncio
+import time
+
+from sqlalchemy import select, exists, and_, bindparam
+
+from database.initialization import AsyncSessionLocal
+from database.schemas import UserProfileModel, ProjectMemberModel
+
+_MISSING = object()
+
+class TTLCache:
+    """Small in-process LRU cache whose entries expire after a fixed TTL"""
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[1]
+
+    def invalidate(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]) -> None:
+        for key in [k for k in self._data if predicate(k)]:
+            del self._data[key]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# user_id -> profile name. Only hits are cached so a freshly created profile is seen immediately
+profile_name_cache = TTLCache(maxsize=4096, ttl=60.0)
+
+async def get_profile_name(user_id: UUID) -> str | None:
+    """Return the user's profile name (None if no profile), served from cache when fresh"""
+    name = profile_name_cache.get(user_id)
+    if name is not None:
+        return name
+
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(UserProfileModel.name).where(UserProfileModel.user_id == user_id)
+        )
+        name = result.scalar_one_or_none()
+
+    if name is not None:
+        profile_name_cache.set(user_id, name)
+    return name
+
+
+# (project_id, before_id, limit) -> (encoded chat history page, ids of its live messages).
+# Only back-scroll pages are cached: new messages never land in them. Each worker has its
+# own copy, so hits are revalidated against the DB rather than trusted
+history_page_cache = TTLCache(maxsize=512, ttl=30.0)
+
+
+# In-flight membership lookups, so concurrent reconnects for the same member share one query
+_chat_member_inflight: dict[tuple[UUID, UUID], asyncio.Task] = {}
+
+_CHAT_MEMBER_STMT = (
+    select(ProjectMemberModel.id, UserProfileModel.name)
+    .outerjoin(UserProfileModel, ProjectMemberModel.user_id == UserProfileModel.user_id)
+    .where(
+        and_(
+            ProjectMemberModel.project_id == bindparam("project_id"),
+            ProjectMemberModel.user_id == bindparam("user_id")
+        )
+    )
+)
+_IS_CHAT_MEMBER_STMT = select(exists().where(
+    and_(
+        ProjectMemberModel.project_id == bindparam("project_id"),
+        ProjectMemberModel.user_id == bindparam("user_id")
+    )
+))
+
+async def get_chat_member_name(project_id: UUID, user_id: UUID) -> str | None:
+    """Return the member's chat name, or None if they aren't a member of the project"""
+    key = (project_id, user_id)
+    task = _chat_member_inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_load_chat_member_name(project_id, user_id))
+        _chat_member_inflight[key] = task
+        task.add_done_callback(lambda _: _chat_member_inflight.pop(key, None))
+    return await asyncio.shield(task)
+
+async def _load_chat_member_name(project_id: UUID, user_id: UUID) -> str | None:
+    # Membership is always read from the DB: a removal handled by another worker (or a
+    # cascade from a deleted project) has to apply on the very next connect. Only the
+    # name is cached, so a cached name turns the lookup into a bare EXISTS
+    params = {"project_id": project_id, "user_id": user_id}
+    name = profile_name_cache.get(user_id)
+    async with AsyncSessionLocal() as session:
+        if name is not None:
+            result = await session.execute(_IS_CHAT_MEMBER_STMT, params)
+            return name if result.scalar() else None
+        result = await session.execute(_CHAT_MEMBER_STMT, params)
+        row = result.one_or_none()
+
+    if row is None:
+        return None
+    if row.name is None:
+        return "Unknown"
+    profile_name_cache.set(user_id, row.name)
+    return row.name
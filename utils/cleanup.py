@@ -2,7 +2,7 @@ from datetime import datetime, timedelta, timezone
 from database.schemas import (
     ProjectModel, ProjectStatusEnum, OTPVerificationModel, RefreshTokenModel
 )
-from sqlalchemy import select, update, func, delete
+from sqlalchemy import update, delete
 from sqlalchemy.ext.asyncio import AsyncSession
 import logging
 
@@ -22,22 +22,8 @@ async def mark_stale_projects_dead(db: AsyncSession, days_threshold: int = 30) -
     try:
         threshold = datetime.now(timezone.utc) - timedelta(days=days_threshold)
         
-        # First, count how many will be affected
-        count_result = await db.execute(
-            select(func.count(ProjectModel.id))
-            .where(
-                ProjectModel.status == ProjectStatusEnum.ACTIVE,
-                ProjectModel.last_status_update < threshold
-            )
-        )
-        count = count_result.scalar()
-        
-        if count == 0:
-            logger.info("No stale projects to mark as DEAD")
-            return 0
-        
-        # Update projects
-        await db.execute(
+        # Update projects - rowcount says how many were affected, no separate COUNT needed
+        result = await db.execute(
             update(ProjectModel)
             .where(
                 ProjectModel.status == ProjectStatusEnum.ACTIVE,
@@ -48,9 +34,14 @@ async def mark_stale_projects_dead(db: AsyncSession, days_threshold: int = 30) -
                 last_status_update=datetime.now(timezone.utc)
             )
         )
+        count = result.rowcount
         
         await db.commit()
         
+        if count == 0:
+            logger.info("No stale projects to mark as DEAD")
+            return 0
+        
         logger.info(f"Marked {count} stale projects as DEAD (inactive for {days_threshold}+ days)")
         return count
         
@@ -70,24 +61,19 @@ async def cleanup_expired_otps(db: AsyncSession) -> int:
         # Delete OTPs that expired more than 1 day ago
         threshold = datetime.now(timezone.utc) - timedelta(days=1)
         
-        count_result = await db.execute(
-            select(func.count(OTPVerificationModel.id))
-            .where(OTPVerificationModel.expires_at < threshold)
-        )
-        count = count_result.scalar()
-        
-        if count == 0:
-            logger.info("No expired OTPs to delete")
-            return 0
-        
         # Delete expired OTPs
-        await db.execute(
+        result = await db.execute(
             delete(OTPVerificationModel)
             .where(OTPVerificationModel.expires_at < threshold)
         )
+        count = result.rowcount
         
         await db.commit()
         
+        if count == 0:
+            logger.info("No expired OTPs to delete")
+            return 0
+        
         logger.info(f"Deleted {count} expired OTP records")
         return count
         
@@ -96,6 +82,33 @@ async def cleanup_expired_otps(db: AsyncSession) -> int:
         await db.rollback()
         return 0
 
+async def expire_stale_otps(db: AsyncSession) -> int:
+    """
+    Mark OTPs past their expiry as used (runs every minute, off the request path).
+    
+    Returns:
+        Number of OTPs expired
+    """
+    try:
+        result = await db.execute(
+            update(OTPVerificationModel)
+            .where(
+                OTPVerificationModel.is_used == False,
+                OTPVerificationModel.expires_at <= datetime.now(timezone.utc)
+            )
+            .values(is_used=True)
+        )
+        await db.commit()
+        
+        if result.rowcount:
+            logger.debug(f"Expired {result.rowcount} stale OTPs")
+        return result.rowcount
+        
+    except Exception as e:
+        logger.error(f"Error expiring OTPs: {e}", exc_info=True)
+        await db.rollback()
+        return 0
+
 async def cleanup_revoked_refresh_tokens(db: AsyncSession) -> int:
     """
     Delete old revoked refresh tokens (keep for 30 days for audit).
@@ -107,29 +120,21 @@ async def cleanup_revoked_refresh_tokens(db: AsyncSession) -> int:
         # Delete revoked tokens older than 30 days
         threshold = datetime.now(timezone.utc) - timedelta(days=30)
         
-        count_result = await db.execute(
-            select(func.count(RefreshTokenModel.id))
+        result = await db.execute(
+            delete(RefreshTokenModel)
             .where(
                 RefreshTokenModel.is_revoked == True,
                 RefreshTokenModel.created_at < threshold
             )
         )
-        count = count_result.scalar()
+        count = result.rowcount
+        
+        await db.commit()
         
         if count == 0:
             logger.info("No old revoked tokens to delete")
             return 0
         
-        await db.execute(
-            delete(RefreshTokenModel)
-            .where(
-                RefreshTokenModel.is_revoked == True,
-                RefreshTokenModel.created_at < threshold
-            )
-        )
-        
-        await db.commit()
-        
         logger.info(f"Deleted {count} old revoked refresh tokens")
         return count
         
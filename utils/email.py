@@ -2,7 +2,6 @@ import secrets
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from fastapi import BackgroundTasks
 from config import SMTP_EMAIL, SMTP_PASSWORD, SMTP_PORT, SMTP_SERVER
 import logging
 
@@ -10,8 +9,8 @@ logger = logging.getLogger(__name__)
 
 def generate_otp(length: int = 6) -> str:
     """Generate a cryptographically secure OTP"""
-    digits = "0123456789"
-    return "".join(secrets.choice(digits) for _ in range(length))
+    # One CSPRNG draw, zero-padded, instead of one draw per digit
+    return f"{secrets.randbelow(10 ** length):0{length}d}"
 
 
 def send_otp_email(email: str, otp: str):
@@ -136,13 +135,3 @@ Filmo Team
         logger.error(f"Unexpected error sending email to {email}: {e}", exc_info=True)
         return False
 
-
-def send_otp(bg: BackgroundTasks, email: str) -> str:
-    """
-    Generate OTP and queue email sending in background.
-    Returns the OTP for storage in database.
-    """
-    otp = generate_otp()
-    bg.add_task(send_otp_email, email, otp)
-    logger.info(f"OTP generated and email queued for {email}")
-    return otp
\ No newline at end of file
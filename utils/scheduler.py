@@ -1,8 +1,9 @@
 # scheduler.py
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from database.initialization import AsyncSessionLocal
-from utils.cleanup import run_all_cleanup_tasks
+from utils.cleanup import run_all_cleanup_tasks, expire_stale_otps
 import logging
 
 logger = logging.getLogger(__name__)
@@ -19,6 +20,11 @@ async def scheduled_cleanup():
         except Exception as e:
             logger.error(f"Scheduled cleanup failed: {e}", exc_info=True)
 
+async def scheduled_otp_expiry():
+    """Expire stale OTPs"""
+    async with AsyncSessionLocal() as db:
+        await expire_stale_otps(db)
+
 def start_scheduler():
     """Start the background scheduler"""
     # Run cleanup every day at 2 AM UTC
@@ -30,8 +36,19 @@ def start_scheduler():
         name='Daily cleanup tasks'
     )
     
+    # Sweep expired OTPs every minute (kept out of the signup/reset request path)
+    scheduler.add_job(
+        scheduled_otp_expiry,
+        trigger=IntervalTrigger(minutes=1),
+        id='otp_expiry',
+        replace_existing=True,
+        name='Expire stale OTPs',
+        max_instances=1,
+        coalesce=True
+    )
+    
     scheduler.start()
-    logger.info("Cleanup scheduler started (runs daily at 2:00 AM UTC)")
+    logger.info("Cleanup scheduler started (runs daily at 2:00 AM UTC, OTP expiry every minute)")
 
 def stop_scheduler():
     """Stop the scheduler gracefully"""
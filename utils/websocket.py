@@ -0,0 +1,58 @@
+from fastapi import WebSocket
+import asyncio
+import logging
+import orjson
+
+logger = logging.getLogger(__name__)
+
+SEND_TIMEOUT = 5.0  # Seconds a single socket may take before it's treated as dead
+OUTBOX_SIZE = 256  # Frames buffered per connection before a slow client is dropped
+
+def encode(message: dict) -> str:
+    """Encode a message once for any number of recipients"""
+    # orjson handles UUID/datetime values natively; decoded so clients get text frames
+    return orjson.dumps(message).decode()
+
+def frame(message: dict) -> dict:
+    """Build a ready-to-send ASGI text frame, for messages that never change"""
+    # OPTIMIZATION: Constant replies are encoded once at import and handed straight to the
+    # ASGI server on every send
+    return {"type": "websocket.send", "text": encode(message)}
+
+# Control frames shared by the chat endpoints, encoded once at import
+PONG_FRAME = frame({"type": "pong"})
+TOKEN_REQUIRED_FRAME = frame({"error": "Token required"})
+INVALID_TOKEN_FRAME = frame({"error": "Invalid token"})
+
+class ConnectionWriter:
+    """Outbound queue for one socket, drained by a single writer task"""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=OUTBOX_SIZE)
+        self.closed = False
+        self.task = asyncio.create_task(self._run())
+
+    def send(self, payload: str) -> bool:
+        """Queue a frame without waiting on the network; False if the client can't keep up"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(payload)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _run(self):
+        while True:
+            payload = await self.queue.get()
+            try:
+                await asyncio.wait_for(self.websocket.send_text(payload), timeout=SEND_TIMEOUT)
+            except Exception as e:
+                logger.error(f"Error sending websocket message: {e}")
+                self.closed = True
+                return
+
+    def close(self):
+        self.closed = True
+        self.task.cancel()